@@ -2,6 +2,7 @@ from .arxiv_vanity import (collect_summary_information,
                            select_most_cited_figures,
                            highlight_author,
                            highlight_authors_in_list,
+                           AuthorMatcher,
                            make_short_author_list,
                            generate_markdown_text)
 
@@ -1,15 +1,26 @@
 """ How to deal with ArXiv and getting papers' information and sources """
 
+import gzip
 import tarfile
 import os
+import warnings
 import shutil
+import tempfile
 import requests
 import re
+import threading
+import time
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 from urllib.request import urlopen
 from bs4 import BeautifulSoup
 from bs4.element import Tag
-from typing import Sequence
+from typing import Sequence, Union
 from datetime import datetime
+from itertools import chain, accumulate
+from .arxiv_vanity import AuthorMatcher
+from . import instrument
 try:
     from IPython.display import Markdown
 except ImportError:
@@ -113,6 +124,7 @@ class ArxivPaper(dict):
         return txt.format(joined_authors=joined_authors, **self)
 
 
+@instrument.timed('listing fetch')
 def get_new_papers() -> Sequence[ArxivPaper]:
     """retrieve the new list from the website.
 
@@ -122,6 +134,7 @@ def get_new_papers() -> Sequence[ArxivPaper]:
 
     response = requests.get(url)
     response.raise_for_status()
+    instrument.add(nbytes=len(response.content))
     soup = BeautifulSoup(response.content, 'html.parser')
     try:
         date = soup.find_all('div', {'class': 'list-dateline'})[0].text.replace('\n', '').split(',')[-1].strip()
@@ -133,9 +146,89 @@ def get_new_papers() -> Sequence[ArxivPaper]:
     new_papers = [ArxivPaper.from_bs4_tags(dt, dd) for dt, dd in zip(r[::2], r[1::2])]
     for paper in new_papers:
         paper['date'] = date
+    instrument.add(count=len(new_papers))
     return new_papers
 
 
+class ListingScreening(dict):
+    """ Result of the screening of a listing against a reference author list
+
+    A dictionary like structure that contains:
+
+    - candidates: the papers with at least one matching author
+    - authors: the author lists with highlighted authors (one list per paper)
+    - matches: per paper list of (author, matched reference name)
+    - statistics: counts of papers, authors, and matches
+    """
+    def __init__(self, **data):
+        super().__init__(data)
+
+    def __repr__(self):
+        txt = """Listing of {papers:,d} papers ({authors:,d} authors, {unique_authors:,d} unique)
+\t{candidates:,d} with possible author matches ({matched_authors:,d} matched authors)"""
+        return txt.format(**self['statistics'])
+
+
+@instrument.timed('screening')
+def screen_listing(papers: Sequence[ArxivPaper],
+                   matcher: Union[Sequence[str], AuthorMatcher],
+                   highlight: bool = True,
+                   inplace: bool = False) -> ListingScreening:
+    """ Select the papers with authors matching the reference list in a single pass
+
+    All author names of the listing are flattened, each distinct name is
+    matched once against the reference index, and the results are scattered
+    back to their papers. The papers of the listing are left unchanged unless
+    `inplace` is set.
+
+    :param papers: the listing (e.g., from :func:`get_new_papers`)
+    :param matcher: the list of reference authors (or an :class:`AuthorMatcher`)
+    :param highlight: set to give the candidates the highlighted list as `authors`
+    :param inplace: set to highlight the authors of the listing papers themselves
+                    instead of returning annotated copies as candidates
+    :return: the screening result (candidates, authors, matches, statistics)
+    """
+    matcher = AuthorMatcher.from_list(matcher)
+
+    # flatten all authors and keep the offsets to scatter the results back
+    flat_authors = list(chain.from_iterable(paper['authors'] for paper in papers))
+    offsets = [0] + list(accumulate(len(paper['authors']) for paper in papers))
+    instrument.add(count=len(flat_authors))
+
+    # match each distinct name only once
+    references = {name: matcher.reference(name) for name in set(flat_authors)}
+    flat_references = [references[name] for name in flat_authors]
+    flat_highlighted = [f"<mark>{name}</mark>" if ref is not None else name
+                        for name, ref in zip(flat_authors, flat_references)]
+
+    candidates, authors, matches = [], [], []
+    for paper, start, end in zip(papers, offsets[:-1], offsets[1:]):
+        hl_authors = flat_highlighted[start:end]
+        paper_matches = [(name, ref) for name, ref in zip(flat_authors[start:end],
+                                                          flat_references[start:end])
+                         if ref is not None]
+        if highlight and (paper_matches or inplace):
+            if not inplace:
+                paper = ArxivPaper(**paper)
+            paper['authors'] = hl_authors
+        authors.append(hl_authors)
+        matches.append(paper_matches)
+        if paper_matches:
+            candidates.append(paper)
+
+    statistics = dict(papers=len(papers),
+                      authors=len(flat_authors),
+                      unique_authors=len(references),
+                      candidates=len(candidates),
+                      matched_authors=sum(len(k) for k in matches),
+                      matched_references=len(set(ref for ref in flat_references if ref is not None)))
+
+    return ListingScreening(candidates=candidates,
+                            authors=authors,
+                            matches=matches,
+                            statistics=statistics)
+
+
 def get_paper_from_identifier(paper_identifier: str) -> ArxivPaper:
     """ Retrieve a paper from Arxiv using its identifier
 
@@ -186,25 +279,369 @@ def get_paper_from_identifier(paper_identifier: str) -> ArxivPaper:
     return ArxivPaper(**data)
 
 
-def retrieve_document_source(identifier: str, directory: str) -> str:
-    """ Retrieve document source tarball and extract it.
+EPRINT_URL = "https://arxiv.org/e-print/{identifier}"
 
-    :param identifier: Paper identification number from Arxiv
+
+# files materialized by the selective extraction (with the files referenced in the sources)
+SOURCE_EXTENSIONS = ('.tex', '.bbl', '.bib', '.sty', '.cls')
+
+
+class _PeekedStream:
+    """ Read-only stream that replays already read bytes before the rest of a stream """
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.head:
+            return self.stream.read(size)
+        if (size is None) or (size < 0):
+            data, self.head = self.head + self.stream.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+
+def _open_eprint(fileobj) -> Union[tarfile.TarFile, bytes]:
+    """ Open an e-print stream which is either a gzipped tarball or a single gzipped file
+
+    :param fileobj: file-like object of the e-print
+    :return: the tarfile object (stream mode) or the content of the single file
+    """
+    stream = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    head = stream.read(tarfile.BLOCKSIZE)
+    try:
+        tarfile.TarInfo.frombuf(head, tarfile.ENCODING, 'surrogateescape')
+    except tarfile.HeaderError:
+        content = head + stream.read()
+        if content.startswith(b'%PDF'):
+            raise RuntimeError("The paper does not have LaTeX source code.")
+        return content
+    return tarfile.open(mode='r|', fileobj=_PeekedStream(head, stream))
+
+
+def _iter_eprint_members(fileobj):
+    """ Iterate over the regular files of an e-print stream
+
+    The data must be read before moving to the next member.
+
+    :param fileobj: file-like object of the e-print
+    :return: generator of (name, size, function returning the data)
+    """
+    eprint = _open_eprint(fileobj)
+    if isinstance(eprint, bytes):
+        yield 'main.tex', len(eprint), lambda: eprint
+        return
+    for member in eprint:
+        if member.isfile():
+            yield member.name, member.size, lambda member=member: eprint.extractfile(member).read()
+
+
+def referenced_files(sources: Sequence[str]) -> set:
+    r""" Names of the files referenced in TeX sources
+
+    Looks for the `\input` and `\include` commands and the graphics commands
+    (`\includegraphics`, `\plotone`, `\plottwo` and `\epsfig`/`\psfig`)
+    outside comments.
+
+    :param sources: TeX sources
+    :return: set of basenames with and without extension
+    """
+    comments = re.compile(r'(?<!\\)%.*')
+    commands = re.compile(r'\\(?:includegraphics\*?(?:\[[^\]]*\])*|plotone|input|include)\s*\{([^}]*)\}'
+                          r'|\\plottwo\s*\{([^}]*)\}\s*\{([^}]*)\}'
+                          r'|\\(?:eps|ps)fig\s*\{[^}]*?file\s*=\s*([^,}]*)'
+                          r'|\\input\s+([^\s{}\\%]+)')
+    references = set()
+    for source in sources:
+        for match in commands.finditer(comments.sub('', source)):
+            for ref in match.groups():
+                if ref:
+                    name = os.path.basename(ref.strip().replace('"', ''))
+                    references.update((name, os.path.splitext(name)[0]))
+    return references
+
+
+def _is_referenced(name: str, references: set) -> bool:
+    """ Check if a file name matches the references """
+    basename = os.path.basename(name)
+    return (basename in references) or (os.path.splitext(basename)[0] in references)
+
+
+def read_source_members(fileobj, selective: bool = True,
+                        max_member_size: int = 20 * 1024 ** 2,
+                        max_total_size: int = 200 * 1024 ** 2) -> dict:
+    """ Read the files of an e-print stream into memory
+
+    In selective mode, only the TeX related files (`SOURCE_EXTENSIONS`) and
+    the files referenced in the TeX sources (inputs and graphics, whatever
+    their extension, see :func:`referenced_files`) are kept.
+    Seekable streams are read twice (once for the TeX files, once for the
+    referenced files), otherwise the other files are spilled to a temporary
+    file until the end of the stream. The spilled files are subject to the
+    same size limits as the kept ones.
+
+    :param fileobj: file-like object of the e-print (gzipped tarball or gzipped single file)
+    :param selective: set to keep only TeX and referenced files
+    :param max_member_size: files larger than this (in bytes) are skipped (None for no limit)
+    :param max_total_size: maximum total size of the kept (and spilled) files (None for no limit)
+    :return: mapping of file names to their content
+    """
+    max_member_size = max_member_size or float('inf')
+    max_total_size = max_total_size or float('inf')
+    two_pass = selective and hasattr(fileobj, 'seekable') and fileobj.seekable()
+    if two_pass:
+        origin = fileobj.tell()
+
+    members = {}
+    candidates = {}
+    spool = None
+    spooled = 0
+    total = 0
+
+    def keep(name: str, size: int, used: int) -> bool:
+        """ check the size limits """
+        if size > max_member_size:
+            warnings.warn(f"Skipping {name:s} ({size:,d} bytes larger than the member limit)")
+            return False
+        if used + size > max_total_size:
+            warnings.warn(f"Skipping {name:s} ({size:,d} bytes exceeds the total size limit)")
+            return False
+        return True
+
+    for name, size, read in _iter_eprint_members(fileobj):
+        extension = os.path.splitext(name)[1].lower()
+        if selective and (extension not in SOURCE_EXTENSIONS):
+            if (not two_pass) and keep(name, size, spooled):
+                if spool is None:
+                    spool = tempfile.TemporaryFile()
+                candidates[name] = (spool.tell(), spool.write(read()))
+                spooled += size
+            continue
+        if not keep(name, size, total):
+            continue
+        members[name] = read()
+        total += size
+
+    if not selective:
+        return members
+
+    references = referenced_files(
+        [v.decode('utf-8', errors='surrogateescape') for k, v in members.items()
+         if k.lower().endswith('.tex')])
+
+    if two_pass:
+        fileobj.seek(origin)
+        for name, size, read in _iter_eprint_members(fileobj):
+            extension = os.path.splitext(name)[1].lower()
+            if ((extension not in SOURCE_EXTENSIONS) and _is_referenced(name, references)
+                    and keep(name, size, total)):
+                members[name] = read()
+                total += size
+    elif spool is not None:
+        with spool:
+            for name, (offset, size) in candidates.items():
+                if _is_referenced(name, references) and keep(name, size, total):
+                    spool.seek(offset)
+                    members[name] = spool.read(size)
+                    total += size
+    return members
+
+
+def _safe_path(directory: str, name: str) -> str:
+    """ Path of a member inside directory (rejects absolute paths and parent references) """
+    where = os.path.normpath(os.path.join(directory, name))
+    if os.path.isabs(name) or os.path.relpath(where, directory).startswith('..'):
+        raise RuntimeError(f"Unsafe file name in archive: {name:s}")
+    return where
+
+
+@instrument.timed('extraction')
+def extract_source(fileobj, directory: str,
+                   selective: bool = False,
+                   max_member_size: int = 20 * 1024 ** 2,
+                   max_total_size: int = 200 * 1024 ** 2) -> str:
+    """ Extract an e-print stream into a fresh directory
+
+    The e-print is either a gzipped tarball or a single gzipped TeX file
+    (stored as `main.tex`).
+
+    :param fileobj: file-like object of the e-print
     :param directory: where to store the extracted files
+    :param selective: set to write only the TeX files and referenced files
+                      (see :func:`read_source_members`)
+    :param max_member_size: selective mode: files larger than this (in bytes) are skipped
+    :param max_total_size: selective mode: maximum total size of the written files
     :return: directory in which the data was extracted
     """
-    where = f"https://arxiv.org/e-print/{identifier}"
-    print("Retrieving document from ", where)
-    tar = tarfile.open(mode='r|gz', fileobj=urlopen(where))
+    if selective:
+        members = read_source_members(fileobj, selective=True,
+                                      max_member_size=max_member_size,
+                                      max_total_size=max_total_size)
+    else:
+        eprint = _open_eprint(fileobj)
+        members = {'main.tex': eprint} if isinstance(eprint, bytes) else None
 
     if os.path.isdir(directory):
         shutil.rmtree(directory)
+
+    if members is None:
+        eprint.extractall(directory)
+        return directory
+
+    os.makedirs(directory)
+    instrument.add(nbytes=sum(len(data) for data in members.values()), count=len(members))
+    for name, data in members.items():
+        try:
+            where = _safe_path(directory, name)
+        except RuntimeError as e:
+            warnings.warn(str(e))
+            continue
+        os.makedirs(os.path.dirname(where), exist_ok=True)
+        with open(where, 'wb') as fout:
+            fout.write(data)
+    return directory
+
+
+@instrument.timed('download')
+def retrieve_document_source(identifier: str, directory: str, cache=None,
+                             selective: bool = False) -> str:
+    """ Retrieve document source tarball and extract it.
+
+    :param identifier: Paper identification number from Arxiv
+    :param directory: where to store the extracted files
+    :param cache: optional :class:`arxiv_on_deck_2.source_cache.SourceCache`
+                  to avoid downloading sources again
+    :param selective: set to extract only the TeX files and referenced files
+    :return: directory in which the data was extracted
+    """
+    if cache is not None:
+        return cache.get_source(identifier, directory=directory, selective=selective)
+    where = EPRINT_URL.format(identifier=identifier)
+    print("Retrieving document from ", where)
+    fileobj = urlopen(where)
     print(f"extracting tarball to {directory:s}...", end='')
-    tar.extractall(directory)
+    extract_source(fileobj, directory, selective=selective)
     print(" done.")
     return directory
 
 
+class _HostRateLimiter:
+    """ Spaces out the requests to the same host by a minimum interval (thread-safe)
+
+    :param min_interval: minimum time in seconds between two requests to a host
+    """
+    def __init__(self, min_interval: float = 0.):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url: str):
+        """ Block until a request to the host of `url` is allowed """
+        if self.min_interval <= 0:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _make_session(pool_size: int) -> requests.Session:
+    """ HTTP session with a connection pool large enough for all workers """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def retrieve_document_sources(identifiers: Sequence[str],
+                              directory: str = "tmp_{identifier}",
+                              max_workers: int = 4,
+                              min_interval: float = 0.5,
+                              timeout: float = 60.,
+                              url: str = EPRINT_URL,
+                              session: requests.Session = None,
+                              cache=None,
+                              selective: bool = False) -> dict:
+    """ Retrieve and extract the source tarballs of multiple documents concurrently
+
+    Downloads share a pooled HTTP session and run in a bounded thread pool.
+    Requests to the same host are spaced by `min_interval` seconds.
+    Failures are recorded per paper and do not abort the batch.
+
+    :param identifiers: Paper identification numbers from Arxiv
+    :param directory: where to store the extracted files,
+                      `{identifier}` is replaced by the paper identifier
+    :param max_workers: number of concurrent downloads
+    :param min_interval: minimum time in seconds between two requests to the same host
+    :param timeout: timeout in seconds of each request
+    :param url: source url template, `{identifier}` is replaced by the paper identifier
+    :param session: HTTP session to use (a pooled session is created if not provided)
+    :param cache: optional :class:`arxiv_on_deck_2.source_cache.SourceCache`,
+                  only sources not stored are downloaded
+    :param selective: set to extract only the TeX files and referenced files
+    :return: a dictionary with the following keys:
+             (retrieved: {identifier: directory}, failed: {identifier: error message},
+              timings: {identifier: seconds}, sizes: {identifier: bytes})
+    """
+    if isinstance(identifiers, str):
+        identifiers = [identifiers]
+    if session is None:
+        session = _make_session(max_workers)
+    limiter = _HostRateLimiter(min_interval)
+
+    def retrieve(identifier: str):
+        """ record the download span and size of one document under its identifier """
+        with instrument.paper_context(identifier), instrument.span('download') as timing:
+            folder, size, elapsed = _retrieve(identifier)
+            timing.add(nbytes=size)
+        return folder, size, elapsed
+
+    def _retrieve(identifier: str):
+        """ download (rate limited per host) or read from the cache, and extract one document """
+        start = time.perf_counter()
+        if (cache is not None) and (identifier in cache):
+            content = cache.get_raw(identifier)
+        else:
+            where = url.format(identifier=identifier)
+            limiter.wait(where)
+            start = time.perf_counter()
+            response = session.get(where, timeout=timeout)
+            response.raise_for_status()
+            content = response.content
+            if cache is not None:
+                cache.put(identifier, content)
+        folder = directory.format(identifier=identifier.replace('/', '_'))
+        extract_source(BytesIO(content), folder, selective=selective)
+        return folder, len(content), time.perf_counter() - start
+
+    report = dict(retrieved={}, failed={}, timings={}, sizes={})
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(retrieve, identifier): identifier
+                   for identifier in identifiers}
+        for future in as_completed(futures):
+            identifier = futures[future]
+            try:
+                folder, size, elapsed = future.result()
+            except Exception as e:
+                report['failed'][identifier] = f"{e.__class__.__name__}: {e}"
+                continue
+            report['retrieved'][identifier] = folder
+            report['timings'][identifier] = elapsed
+            report['sizes'][identifier] = size
+    print("Retrieved {0:,d} document sources ({1:,d} failed)".format(
+        len(report['retrieved']), len(report['failed'])))
+    return report
+
+
 def get_markdown_badge(identifier: str) -> str:
     """ Generate the markdown badge for a paper
 
@@ -13,7 +13,7 @@ import requests
 import re
 from requests.exceptions import HTTPError
 from bs4 import BeautifulSoup
-from typing import Sequence
+from typing import Sequence, Union
 import time
 
 
@@ -201,34 +201,121 @@ def author_match(author: str, hl_list: Sequence[str], verbose=False) -> Sequence
             return match
 
 
+def _word_boundaries(text: str) -> Sequence[int]:
+    """ Positions of the regex word boundaries (``\\b``) in a string
+
+    :param text: string to analyze
+    :return: sorted list of boundary positions
+    """
+    isword = [(c.isalnum() or c == '_') for c in text]
+    previous = [False] + isword
+    following = isword + [False]
+    return [pos for pos, (a, b) in enumerate(zip(previous, following)) if a != b]
+
+
+class AuthorMatcher:
+    """ Compiled index of reference author names
+
+    The index is built once from the reference list and reproduces the
+    matching of :func:`author_match` (an author matches a reference name if
+    it appears as whole words in it, case insensitive) with a single hash
+    lookup per author instead of a regular expression per (author, name) pair.
+
+    It can be given anywhere a `hl_list` is expected, e.g.,
+    :func:`highlight_authors_in_list`, :func:`highlight_author` and
+    :func:`arxiv_on_deck_2.latex.LatexDocument.highlight_authors_in_list`.
+
+    :param hl_list: the list of reference authors to match
+    """
+    def __init__(self, hl_list: Sequence[str]):
+        self.hl_list = list(hl_list)
+        self._index = {}
+        for num, hl in enumerate(self.hl_list):
+            lowered = hl.lower()
+            boundaries = _word_boundaries(lowered)
+            for e, start in enumerate(boundaries):
+                for end in boundaries[e + 1:]:
+                    # keep the first reference name in list order
+                    self._index.setdefault(lowered[start:end], num)
+
+    @classmethod
+    def from_list(cls, hl_list: Union[Sequence[str], 'AuthorMatcher']) -> 'AuthorMatcher':
+        """ Get a matcher from a reference list (or return the matcher itself)
+
+        :param hl_list: the list of reference authors or a matcher
+        :return: the matcher object
+        """
+        if isinstance(hl_list, cls):
+            return hl_list
+        if isinstance(hl_list, str):
+            hl_list = [hl_list]
+        return cls(hl_list)
+
+    def __len__(self) -> int:
+        return len(self.hl_list)
+
+    def __contains__(self, author: str) -> bool:
+        return author.lower() in self._index
+
+    def match(self, author: str, verbose: bool = False) -> Sequence[str]:
+        """ Matching author name with the reference list
+
+        :param author: the author string to check
+        :param verbose: prints matching results if set
+        :return: the matching sequences or None
+        """
+        num = self._index.get(author.lower())
+        if num is None:
+            return None
+        hl = self.hl_list[num]
+        match = re.findall(r"\b{:s}\b".format(re.escape(author)), hl, re.IGNORECASE)
+        if verbose:
+            print(author, ' -> ',  hl, ' | ', match)
+        return match
+
+    def reference(self, author: str) -> Union[str, None]:
+        """ Reference name matched by an author
+
+        :param author: the author string to check
+        :return: the matching reference name or None
+        """
+        num = self._index.get(author.lower())
+        if num is None:
+            return None
+        return self.hl_list[num]
+
+    def highlight(self, author_list: Sequence[str], verbose: bool = False) -> Sequence[str]:
+        """ highlight all authors that match the reference list
+
+        :param author_list: the list of authors
+        :param verbose: prints matching results if set
+        :return: the list of authors with the highlighted authors
+        """
+        return [f"<mark>{author}</mark>" if self.match(author, verbose=verbose) else f"{author}"
+                for author in author_list]
+
+
 def highlight_authors_in_list(author_list: Sequence[str], 
-                              hl_list: Sequence[str], 
+                              hl_list: Union[Sequence[str], AuthorMatcher],
                               verbose: bool = False) -> Sequence[str]:
     """ highlight all authors of the paper that match `lst` entries
 
     :param author_list: the list of authors
-    :param hl_list: the list of authors to highlight
+    :param hl_list: the list of authors to highlight (or an :class:`AuthorMatcher`)
     :param verbose: prints matching results if set
     :return: the list of authors with the highlighted authors
     """
-    new_authors = []
-    for author in author_list:
-        match = author_match(author, hl_list, verbose=verbose)
-        if match:
-            new_authors.append(f"<mark>{author}</mark>")
-        else:
-            new_authors.append(f"{author}")
-    return new_authors
+    return AuthorMatcher.from_list(hl_list).highlight(author_list, verbose=verbose)
   
-def highlight_author(author_list: Sequence[str], author: str) -> Sequence[str]:
+def highlight_author(author_list: Sequence[str],
+                     author: Union[str, AuthorMatcher]) -> Sequence[str]:
     """ Highlight a particular author in the list of authors
 
     :param author_list: the list of authors
-    :param author: the author to highlight
+    :param author: the author to highlight (or an :class:`AuthorMatcher`)
     :return: the list of authors with the highlighted author
     """
-    new_lst = [f"<mark>{name}</mark>" if author_match(name, author) else name for name in author_list]
-    return new_lst
+    return AuthorMatcher.from_list(author).highlight(author_list)
 
 
 def make_short_author_list(authors: Sequence[str],
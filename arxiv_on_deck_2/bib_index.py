@@ -0,0 +1,191 @@
+""" Key-offset indexes of bibliography files
+
+Only the few references cited in a summary need to be parsed from the
+bibliography of a paper, which can be a large shared `.bib` database. The
+index of a `.bbl` or `.bib` file maps each entry key (lower case, as keys
+are case insensitive) to the span of its definition in the file content,
+so that only the cited entries are parsed (see
+:meth:`arxiv_on_deck_2.latex_bib.LatexBib.from_doc`). `@string` definitions
+of `.bib` files are indexed too, as entries may use them.
+
+Indexes are stored as JSON, keyed by the hash of the file content.
+
+Layout of the cache directory::
+
+    ab/abcd....json     index of a file
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Sequence
+
+
+# increase when the index structure changes
+INDEX_VERSION = 2
+
+# start of the bibitem entries of bbl files
+_BIBITEM = re.compile(r'\\bibitem', re.IGNORECASE)
+# key of a bibitem entry
+_BIBITEM_KEY = re.compile(r'\\bibitem\s*(?:\[[^\[\]]*\])?\s*\{([^{}]*)\}', re.IGNORECASE)
+# start of the entries of bib files (type, opening delimiter and key if any)
+_BIB_ENTRY = re.compile(r'@\s*(\w+)\s*([{(])\s*([^,\s{}()]*)')
+# delimiters of the body of bib entries
+_BIB_DELIMITERS = re.compile(r'[{}()"]')
+
+
+def _add(entries: dict, key: str, start: int, end: int):
+    """ record the span of an entry (the first definition wins as in pybtex) """
+    key = key.strip().lower()
+    if key and key not in entries:
+        entries[key] = [start, end]
+
+
+def index_bbl(content: str) -> dict:
+    """ Index of the bibitem entries of a bbl file
+
+    :param content: content of the file
+    :return: dict(entries={key: [start, end]}, strings=[])
+    """
+    starts = [match.start() for match in _BIBITEM.finditer(content)]
+    entries = {}
+    for start, end in zip(starts, starts[1:] + [len(content)]):
+        match = _BIBITEM_KEY.match(content, start)
+        if match is not None:
+            _add(entries, match.group(1), start, end)
+    return dict(entries=entries, strings=[])
+
+
+def _entry_end(content: str, pos: int, closing: str) -> int:
+    """ Position after the body of a bib entry
+
+    Braces are balanced in the body, so that `@`, `(` or `)` in field values
+    do not end the entry; `)` ends a parenthesised entry only outside of
+    braces and quoted values.
+
+    :param content: content of the file
+    :param pos: position after the opening delimiter of the body
+    :param closing: closing delimiter of the body (`}` or `)`)
+    :return: position after the closing delimiter (end of the content if none)
+    """
+    depth = 0
+    quoted = False
+    for match in _BIB_DELIMITERS.finditer(content, pos):
+        char = match.group()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            if depth == 0:
+                return match.end()
+            depth -= 1
+        elif depth == 0:
+            if char == '"':
+                quoted = not quoted
+            elif (char == ')') and (closing == ')') and not quoted:
+                return match.end()
+    return len(content)
+
+
+def index_bib(content: str) -> dict:
+    """ Index of the entries of a bib file
+
+    Entries are only looked for between the previous ones, as when parsing
+    the file, so that `@` in field values does not start an entry.
+
+    :param content: content of the file
+    :return: dict(entries={key: [start, end]}, strings=[[start, end], ...])
+    """
+    entries = {}
+    strings = []
+    pos = 0
+    while True:
+        match = _BIB_ENTRY.search(content, pos)
+        if match is None:
+            break
+        kind = match.group(1).lower()
+        if kind == 'comment':
+            # as in pybtex, only the command is skipped, not its body
+            pos = match.end(2)
+            continue
+        end = _entry_end(content, match.end(2), '}' if match.group(2) == '{' else ')')
+        if kind == 'string':
+            strings.append([match.start(), end])
+        elif kind != 'preamble':
+            _add(entries, match.group(3), match.start(), end)
+        pos = end
+    return dict(entries=entries, strings=strings)
+
+
+def get_spans(index: dict, keys: Sequence[str]) -> Sequence[Sequence[int]]:
+    """ Sorted spans of the entries of some keys (unknown keys are ignored)
+
+    :param index: index of the file
+    :param keys: entry keys
+    :return: [start, end] spans
+    """
+    entries = index['entries']
+    spans = {tuple(entries[key.lower()]) for key in keys if key.lower() in entries}
+    return [list(span) for span in sorted(spans)]
+
+
+class BibIndex:
+    """ On-disk cache of bibliography file indexes
+
+    :param directory: where to store the cache (None to keep the indexes in memory only)
+    """
+    def __init__(self, directory: str = "tmp_bib_index"):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(content: str, kind: str) -> str:
+        """ Key of the index of a file
+
+        :param content: content of the file
+        :param kind: kind of file (bbl, bib)
+        :return: hexadecimal digest
+        """
+        digest = hashlib.sha256(f"{INDEX_VERSION}:{kind}:".encode())
+        digest.update(content.encode('utf-8', errors='surrogateescape'))
+        return digest.hexdigest()
+
+    def _file(self, key: str) -> str:
+        """ filename of an entry """
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, content: str, kind: str) -> dict:
+        """ Index of a file, built and stored if needed
+
+        :param content: content of the file
+        :param kind: kind of file (bbl, bib)
+        :return: the index (see :func:`index_bbl` and :func:`index_bib`)
+        """
+        key = self.key(content, kind)
+        index = self._memory.get(key)
+        if (index is None) and (self.directory is not None):
+            try:
+                with open(self._file(key), 'r') as fin:
+                    index = json.load(fin)
+            except (FileNotFoundError, json.JSONDecodeError):
+                index = None
+        if index is not None:
+            self.hits += 1
+            self._memory[key] = index
+            return index
+        self.misses += 1
+        index = index_bbl(content) if kind == 'bbl' else index_bib(content)
+        self._memory[key] = index
+        if self.directory is not None:
+            fname = self._file(key)
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            tmpfile = fname + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmpfile, 'w') as fout:
+                json.dump(index, fout)
+            os.replace(tmpfile, fname)
+        return index
@@ -0,0 +1,96 @@
+""" On-disk cache of the rasterised PDF/EPS figures
+
+Converting PDF and EPS figures into PNG (or JPEG, WebP) images (see
+:func:`arxiv_on_deck_2.latex.convert_pdf_to_image` and
+:func:`arxiv_on_deck_2.latex.convert_eps_to_image`) is slow and gives the
+same result every time a paper is processed. The cache stores the converted
+pages, keyed by the hash of the original file content, its kind and the
+conversion settings (resolution, size, format).
+
+Layout of the cache directory::
+
+    ab/abcd.../1        first page of the rasterised figure
+    ab/abcd.../2        ...
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from typing import Sequence, Union
+
+
+class FigureCache:
+    """ On-disk cache of rasterised figures
+
+    :param directory: where to store the cache
+    """
+    def __init__(self, directory: str = "tmp_figure_cache"):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(data: bytes, kind: str, settings: str) -> str:
+        """ Key of a figure
+
+        :param data: content of the original file
+        :param kind: kind of the original file (pdf, eps)
+        :param settings: description of the conversion settings
+        :return: hexadecimal digest
+        """
+        digest = hashlib.sha256(f"{kind}:{settings}:".encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _dir(self, key: str) -> str:
+        """ directory of an entry """
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, data: bytes, kind: str, settings: str) -> Union[Sequence[bytes], None]:
+        """ Converted pages of a figure if stored
+
+        :param data: content of the original file
+        :param kind: kind of the original file (pdf, eps)
+        :param settings: description of the conversion settings
+        :return: the content of the pages or None
+        """
+        where = self._dir(self.key(data, kind, settings))
+        pages = []
+        try:
+            num = 1
+            while os.path.exists(os.path.join(where, f'{num:d}')):
+                with open(os.path.join(where, f'{num:d}'), 'rb') as fin:
+                    pages.append(fin.read())
+                num += 1
+        except OSError:
+            pages = []
+        if not pages:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pages
+
+    def put(self, data: bytes, kind: str, settings: str, pages: Sequence[bytes]) -> str:
+        """ Store the converted pages of a figure
+
+        :param data: content of the original file
+        :param kind: kind of the original file (pdf, eps)
+        :param settings: description of the conversion settings
+        :param pages: content of the converted pages
+        :return: the key of the entry
+        """
+        key = self.key(data, kind, settings)
+        where = self._dir(key)
+        tmpdir = where + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(tmpdir, exist_ok=True)
+        for num, page in enumerate(pages, 1):
+            with open(os.path.join(tmpdir, f'{num:d}'), 'wb') as fout:
+                fout.write(page)
+        try:
+            os.rename(tmpdir, where)
+        except OSError:
+            # already stored by another process
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        return key
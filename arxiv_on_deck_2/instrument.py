@@ -0,0 +1,341 @@
+""" Lightweight instrumentation of the pipeline stages
+
+Records the duration of named stages (listing fetch, staff scrape,
+screening, download, extraction, cleaning, TexSoup parsing, figure
+conversion, bibliography parsing, markdown generation), with optional byte
+and item counts, per paper. Counters (e.g., cache hits) are recorded
+separately from the timed stages.
+
+Instrumentation is disabled by default: a disabled span or timed function
+only checks a flag.
+
+Example::
+
+    from arxiv_on_deck_2 import instrument
+    instrument.enable()
+    with instrument.paper_context('2103.01970'):
+        doc = LatexDocument(folder)
+    instrument.write_report()   # timing-{today}.json and timing-{today}.md
+"""
+
+import contextvars
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+from typing import Sequence, Tuple
+
+
+class _State:
+    """ global switch and records """
+    enabled = False
+    records = []
+    lock = threading.Lock()
+
+
+_current_paper = contextvars.ContextVar('current_paper', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def enable():
+    """ Start recording """
+    _State.enabled = True
+
+
+def disable():
+    """ Stop recording (records are kept) """
+    _State.enabled = False
+
+
+def is_enabled() -> bool:
+    """ Check if recording """
+    return _State.enabled
+
+
+def reset():
+    """ Remove all records """
+    with _State.lock:
+        _State.records = []
+
+
+def get_records() -> Sequence[dict]:
+    """ Copy of all records
+
+    Timed spans have `kind='span'` (stage, paper, start, duration, bytes,
+    count, failed), counters have `kind='counter'` (stage, paper, bytes, count).
+    """
+    with _State.lock:
+        return list(_State.records)
+
+
+def add_records(records: Sequence[dict]):
+    """ Add records collected elsewhere (e.g., in worker processes) """
+    with _State.lock:
+        _State.records.extend(records)
+
+
+class _NullSpan:
+    """ Span used when the instrumentation is disabled """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add(self, nbytes: int = 0, count: int = 0):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """ Time a stage of the processing
+
+    :param stage: name of the stage
+    :param paper: paper identifier (default the current paper context)
+    """
+    def __init__(self, stage: str, paper: str = None):
+        self.stage = stage
+        self.paper = paper if paper is not None else _current_paper.get()
+        self.nbytes = 0
+        self.count = 0
+        self.start = None
+
+    def add(self, nbytes: int = 0, count: int = 0):
+        """ Add processed bytes and items to the record
+
+        :param nbytes: number of bytes
+        :param count: number of items
+        """
+        self.nbytes += nbytes
+        self.count += count
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._tic = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._tic
+        _current_span.reset(self._token)
+        record = dict(kind='span', stage=self.stage, paper=self.paper,
+                      start=self.start, duration=duration,
+                      bytes=self.nbytes, count=self.count,
+                      failed=exc_type is not None)
+        with _State.lock:
+            _State.records.append(record)
+        return False
+
+
+def span(stage: str, paper: str = None):
+    """ Context manager timing a stage (no-op when disabled)
+
+    :param stage: name of the stage
+    :param paper: paper identifier (default the current paper context)
+    :return: span object (use `.add(nbytes=, count=)` to record sizes)
+    """
+    if not _State.enabled:
+        return _NULL_SPAN
+    return Span(stage, paper)
+
+
+def add(nbytes: int = 0, count: int = 0):
+    """ Add processed bytes and items to the innermost running span (no-op when disabled)
+
+    :param nbytes: number of bytes
+    :param count: number of items
+    """
+    if not _State.enabled:
+        return
+    current = _current_span.get()
+    if current is not None:
+        current.add(nbytes=nbytes, count=count)
+
+
+def add_count(stage: str, count: int = 0, nbytes: int = 0, paper: str = None):
+    """ Record a counter (e.g., cache hits; no-op when disabled)
+
+    Counters are not timed: they are aggregated by :func:`counters` and
+    left out of the timings of :func:`summary` and :func:`per_paper`.
+
+    :param stage: name of the counter
+    :param count: number of items
+    :param nbytes: number of bytes
+    :param paper: paper identifier (default the current paper context)
+    """
+    if not _State.enabled:
+        return
+    record = dict(kind='counter', stage=stage,
+                  paper=paper if paper is not None else _current_paper.get(),
+                  bytes=nbytes, count=count)
+    with _State.lock:
+        _State.records.append(record)
+
+
+def timed(stage: str):
+    """ Decorator timing each call of a function as a stage
+
+    :param stage: name of the stage
+    """
+    def deco(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _State.enabled:
+                return func(*args, **kwargs)
+            with Span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+class paper_context:
+    """ Attribute the spans of a block to a paper
+
+    :param paper: paper identifier
+    """
+    def __init__(self, paper: str):
+        self.paper = paper
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_paper.set(self.paper)
+        return self
+
+    def __exit__(self, *args):
+        _current_paper.reset(self._token)
+        return False
+
+
+def _is_span(record: dict) -> bool:
+    """ Check if a record is a timed span (records without kind are spans) """
+    return record.get('kind', 'span') == 'span'
+
+
+def summary(records: Sequence[dict] = None) -> dict:
+    """ Aggregate the timed records per stage
+
+    :param records: records to aggregate (default all)
+    :return: {stage: dict(calls, total, mean, max, bytes, count, papers)}
+    """
+    if records is None:
+        records = get_records()
+    stages = {}
+    for record in filter(_is_span, records):
+        current = stages.setdefault(record['stage'],
+                                    dict(calls=0, total=0., max=0., bytes=0, count=0,
+                                         papers=set()))
+        current['calls'] += 1
+        current['total'] += record['duration']
+        current['max'] = max(current['max'], record['duration'])
+        current['bytes'] += record['bytes']
+        current['count'] += record['count']
+        if record['paper'] is not None:
+            current['papers'].add(record['paper'])
+    for current in stages.values():
+        current['mean'] = current['total'] / current['calls']
+        current['papers'] = len(current['papers'])
+    return stages
+
+
+def counters(records: Sequence[dict] = None) -> dict:
+    """ Aggregate the counters
+
+    :param records: records to aggregate (default all)
+    :return: {counter: dict(count, bytes, papers)}
+    """
+    if records is None:
+        records = get_records()
+    totals = {}
+    for record in records:
+        if _is_span(record):
+            continue
+        current = totals.setdefault(record['stage'], dict(count=0, bytes=0, papers=set()))
+        current['count'] += record['count']
+        current['bytes'] += record['bytes']
+        if record['paper'] is not None:
+            current['papers'].add(record['paper'])
+    for current in totals.values():
+        current['papers'] = len(current['papers'])
+    return totals
+
+
+def per_paper(records: Sequence[dict] = None) -> dict:
+    """ Total duration per paper and stage
+
+    :param records: records to aggregate (default all)
+    :return: {paper: {stage: seconds}}
+    """
+    if records is None:
+        records = get_records()
+    papers = {}
+    for record in filter(_is_span, records):
+        if record['paper'] is None:
+            continue
+        current = papers.setdefault(record['paper'], {})
+        current[record['stage']] = current.get(record['stage'], 0.) + record['duration']
+    return papers
+
+
+def generate_markdown_report(records: Sequence[dict] = None) -> str:
+    """ Markdown tables of the timings per stage, of the counters and of the slowest papers
+
+    :param records: records to report (default all)
+    :return: markdown text
+    """
+    if records is None:
+        records = get_records()
+    text = ["## Timing per stage\n",
+            "| stage | calls | papers | total (s) | mean (s) | max (s) | MB | items |",
+            "|:---|---:|---:|---:|---:|---:|---:|---:|"]
+    stages = sorted(summary(records).items(), key=lambda x: x[1]['total'], reverse=True)
+    for stage, info in stages:
+        text.append("| {0:s} | {calls:,d} | {papers:,d} | {total:.3f} | {mean:.3f} | {max:.3f} | "
+                    "{1:.2f} | {count:,d} |".format(stage, info['bytes'] / 1024 ** 2, **info))
+
+    totals = counters(records)
+    if totals:
+        text.extend(["\n## Counters\n",
+                     "| counter | papers | MB | items |",
+                     "|:---|---:|---:|---:|"])
+        for name, info in sorted(totals.items()):
+            text.append("| {0:s} | {papers:,d} | {1:.2f} | {count:,d} |".format(
+                name, info['bytes'] / 1024 ** 2, **info))
+
+    papers = per_paper(records)
+    if papers:
+        text.extend(["\n## Slowest papers\n",
+                     "| paper | longest stage (s) | stage |",
+                     "|:---|---:|:---|"])
+        # nested stages overlap: rank on the longest stage
+        ranked = sorted(papers.items(), key=lambda x: max(x[1].values()), reverse=True)
+        for paper, info in ranked[:20]:
+            stage, duration = max(info.items(), key=lambda x: x[1])
+            text.append(f"| {paper:s} | {duration:.3f} | {stage:s} |")
+    return '\n'.join(text) + '\n'
+
+
+def write_report(directory: str = '.', today: str = None) -> Tuple[str, str]:
+    """ Write the timing report as JSON (all records) and markdown (summary)
+
+    The files are named as the daily logs: `timing-{today}.json` and `timing-{today}.md`.
+
+    :param directory: where to write the files
+    :param today: date string (default today)
+    :return: names of the json and markdown files
+    """
+    if today is None:
+        today = str(datetime.date.today())
+    records = get_records()
+    json_fname = os.path.join(directory, f"timing-{today}.json")
+    md_fname = os.path.join(directory, f"timing-{today}.md")
+    with open(json_fname, 'w') as fout:
+        json.dump(dict(summary=summary(records), counters=counters(records), records=records),
+                  fout, indent=1)
+    with open(md_fname, 'w') as fout:
+        fout.write(f'# Arxiv on Deck 2: Timings - {today}\n\n')
+        fout.write(generate_markdown_report(records))
+    return json_fname, md_fname
@@ -1,8 +1,13 @@
+import bisect
+import contextvars
+import math
 import os
+import posixpath
 from glob import glob
 import warnings
-import pathlib
-from typing import Union, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Union, Sequence, Mapping, Iterable, Iterator, Tuple
 import re
 from TexSoup import TexSoup, TexNode
 from TexSoup.tex import TexMathModeEnv
@@ -11,7 +16,9 @@ try:
 except ImportError:
     Markdown = None
 from pdf2image import convert_from_path
-from .arxiv_vanity import highlight_authors_in_list
+from .arxiv_vanity import highlight_authors_in_list, AuthorMatcher
+from .source_tree import SourceTree, as_source_tree
+from . import instrument
 # Requires poppler system library
 # !pip3 install pdf2image
 
@@ -34,106 +41,351 @@ def drop_none_from_list(list_: Sequence) -> Sequence:
     return [k for k in list_ if k is not None]
 
 
-def find_main_doc(folder: str) -> Union[str, Sequence[str]]:
+_MAIN_DOC_CACHE = {}
+_MAIN_DOC_CACHE_SIZE = 1024
+
+# commands that cannot precede \documentclass: stop reading a file head there
+_MAIN_DOC_HEAD_STOP = re.compile(r'\\(?:begin\{document\}|(?:section|chapter)\b)')
+
+
+def _has_documentclass(tree: SourceTree, fname: str, head_size: int = 65536) -> bool:
+    r""" Check if a file defines `\documentclass` reading only its head
+
+    Reading stops at the definition, at the first `\begin{document}`,
+    `\section` or `\chapter`, or after `head_size` bytes.
+    Commented definitions are ignored.
+    """
+    nbytes = 0
+    with tree.open(fname) as fin:
+        lines = (line.decode('utf-8', errors='surrogateescape') for line in fin)
+        for line in strip_latex_comments(lines):
+            if '\\documentclass' in line:
+                return True
+            if _MAIN_DOC_HEAD_STOP.search(line):
+                return False
+            nbytes += len(line) + 1
+            if nbytes > head_size:
+                return False
+    return False
+
+
+def find_main_doc(folder: Union[str, SourceTree],
+                  texfiles: Sequence[str] = None,
+                  reader: 'IncludeResolver' = None) -> Union[str, Sequence[str]]:
     """ Attempt to find which TeX file is the main document.
 
-    :param folder: folder containing the document
+    Only the heads of the files are read to find the `\\documentclass`
+    definitions; candidates are read fully only if there are several.
+    The decision is memoised per state of the tree (see
+    :meth:`arxiv_on_deck_2.source_tree.SourceTree.fingerprint`).
+
+    :param folder: folder (or source tree) containing the document
+    :param texfiles: tex files of the tree (default all)
+    :param reader: include resolver to share the file reads with
     :return: filename of the main document
     """
-
-    texfiles = list(pathlib.Path(f"{folder}").glob("**/*.tex"))
+    tree = as_source_tree(folder)
+    if texfiles is None:
+        texfiles = tree.glob("**/*.tex")
+    texfiles = [str(k) for k in texfiles]
 
     if (len(texfiles) == 1):
-        return str(texfiles[0])
+        return texfiles[0]
+
+    key = tree.fingerprint(texfiles)
+    if key in _MAIN_DOC_CACHE:
+        relative = _MAIN_DOC_CACHE[key]
+        for fname in texfiles:
+            if tree.relative_path(fname) == relative:
+                return fname
 
     warnings.warn(LatexWarning('Multiple tex files.\n'), stacklevel=4)
     selected = None
-    candidates = []
-    # Define a regular expression pattern to match the content starting with % and ending with \n but not including the \n
-    latex_comment_pattern = r"%.*(?=\n)"
-    for e, fname in enumerate(texfiles):
-        with open(fname, 'r', errors="surrogateescape") as finput:
-            content = finput.read()
-            if 'documentclass' in content:
-                length = re.sub(latex_comment_pattern, "", content).count("\n")
-                candidates.append((e, str(fname), length))
+    candidates = [(e, fname) for e, fname in enumerate(texfiles)
+                  if _has_documentclass(tree, fname)]
     if len(candidates) == 1:
         selected = candidates[0][1]
         warnings.warn(LatexWarning(
             "Found documentclass in {0:s}\n".format(str(selected))), stacklevel=4)
-    else:
+    elif candidates:
         warnings.warn(LatexWarning(f"Found {len(candidates)} candidates with documentclass definition."), stacklevel=4)
-        for e, fname, n in candidates:
+        lengths = []
+        for e, fname in candidates:
+            try:
+                content = reader.read(fname) if reader is not None else None
+            except UnicodeDecodeError:
+                content = None
+            if content is None:
+                content = tree.read_text(fname, errors="surrogateescape")
+            n = content.count("\n")
+            lengths.append((e, fname, n))
             print(f"  {e}: {fname}, {n:,d} lines")
-        _, fname, _ = max(candidates, key=lambda x: x[2])
+        _, fname, _ = max(lengths, key=lambda x: x[2])
         warnings.warn(LatexWarning(f"Assuming {fname} as main document."), stacklevel=4)
         selected = fname
     if selected is None:
         raise RuntimeError('Could not locate the main document automatically.'
                            'Little help please!')
+    if len(_MAIN_DOC_CACHE) >= _MAIN_DOC_CACHE_SIZE:
+        _MAIN_DOC_CACHE.pop(next(iter(_MAIN_DOC_CACHE)))
+    _MAIN_DOC_CACHE[key] = tree.relative_path(selected)
     return str(selected)
 
 
-def convert_pdf_to_image(fname: str) -> str:
-    """ Convert image from PDF to png.
+# maximum size in pixels (width, height) of the converted figures
+FIGURE_BOX = (1200, 800)
 
-    The new image is stored with the original one
+# extensions of the output formats of the converted figures
+_IMAGE_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}
 
-    :param fname: file to potentially convert
+# uncompressed objects of PDF files and the page attributes of their dictionaries
+_PDF_OBJECT = re.compile(rb'(\d+)\s+\d+\s+obj\b(.*?)\bendobj', re.DOTALL)
+_PDF_PAGE_TYPE = re.compile(rb'/Type\s*/(Pages?)(?![A-Za-z])')
+_PDF_PAGE_BOX = re.compile(
+    rb'/(MediaBox|CropBox)\s*\[\s*(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*\]')
+_PDF_ROTATE = re.compile(rb'/Rotate\s+(-?\d+)')
+_PDF_PARENT = re.compile(rb'/Parent\s+(\d+)\s+\d+\s+R')
+
+
+def fit_dpi(size: Tuple[float, float], box: Tuple[int, int] = FIGURE_BOX,
+            max_dpi: float = 500) -> int:
+    """ Resolution at which a page fits in a box of pixels
+
+    :param size: width and height of the page in points (1/72 inch)
+    :param box: maximum width and height in pixels
+    :param max_dpi: maximum resolution
+    :return: resolution in dots per inch
     """
-    from pdf2image import convert_from_path
-    pages = convert_from_path(fname, dpi=500, use_cropbox=True)
-    rootname = fname.replace('.pdf', '')
+    width, height = (max(abs(float(k)), 1.) for k in size)
+    dpi = 72. * min(box[0] / width, box[1] / height)
+    return max(1, int(min(dpi, max_dpi)))
+
+
+def _pdf_page_tree(data: bytes) -> dict:
+    """ Attributes of the page and page tree objects of a PDF file
+
+    :param data: content of the PDF file
+    :return: {object number: dict(kind, boxes, rotate, parent)}
+    """
+    nodes = {}
+    for match in _PDF_OBJECT.finditer(data):
+        body = match.group(2).split(b'stream', 1)[0]
+        kind = _PDF_PAGE_TYPE.search(body)
+        if kind is None:
+            continue
+        rotate = _PDF_ROTATE.search(body)
+        parent = _PDF_PARENT.search(body)
+        nodes[int(match.group(1))] = dict(
+            kind=kind.group(1),
+            boxes={name: tuple(float(k) for k in box)
+                   for name, *box in _PDF_PAGE_BOX.findall(body)},
+            rotate=int(rotate.group(1)) if rotate else None,
+            parent=int(parent.group(1)) if parent else None)
+    return nodes
+
+
+def _inherited(nodes: dict, node: dict, attribute: str, name: bytes = None):
+    """ attribute of a page, inherited from the page tree if not defined """
+    seen = set()
+    while node is not None:
+        value = node[attribute].get(name) if name else node[attribute]
+        if value is not None:
+            return value
+        if node['parent'] in seen:
+            break
+        seen.add(node['parent'])
+        node = nodes.get(node['parent'])
+    return None
+
+
+def get_pdf_page_sizes(data: bytes) -> Sequence[Tuple[float, float]]:
+    """ Sizes in points of the pages of a PDF file as displayed
+
+    The CropBox (or MediaBox) and the rotation of each page object are used,
+    inherited from the page tree nodes if needed; the width and height of
+    pages rotated by 90 or 270 degrees are swapped. Page objects stored in
+    compressed object streams are not found, in which case poppler is asked
+    for the size of the first page.
+
+    :param data: content of the PDF file
+    :return: (width, height) of the pages found
+    """
+    nodes = _pdf_page_tree(data)
+    sizes = []
+    for node in nodes.values():
+        if node['kind'] != b'Page':
+            continue
+        box = (_inherited(nodes, node, 'boxes', b'CropBox') or
+               _inherited(nodes, node, 'boxes', b'MediaBox'))
+        if box is None:
+            continue
+        x0, y0, x1, y1 = box
+        size = (abs(x1 - x0), abs(y1 - y0))
+        if (_inherited(nodes, node, 'rotate') or 0) % 180 == 90:
+            size = size[::-1]
+        sizes.append(size)
+    if not sizes:
+        from pdf2image import pdfinfo_from_bytes
+        try:
+            info = pdfinfo_from_bytes(data)
+            width, height = info['Page size'].split()[:3:2]
+            size = (float(width), float(height))
+            if int(float(info.get('Page rot', 0))) % 180 == 90:
+                size = size[::-1]
+            sizes = [size]
+        except Exception:
+            sizes = []
+    return sizes
+
+
+def _encode_image(image, image_format: str = 'PNG', quality: int = 85, **kwargs) -> bytes:
+    """ Content of a PIL image in the given format """
+    from io import BytesIO
+    buffer = BytesIO()
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if image_format in ('JPEG', 'WEBP'):
+        kwargs['quality'] = quality
+    image.save(buffer, image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def _store_pages(tree: SourceTree, rootname: str, pages: Sequence[bytes],
+                 extension: str = 'png') -> str:
+    """ Write the converted pages next to the original image and return the image name """
     if len(pages) > 1:
         for num, page in enumerate(pages, 1):
-            page.save(f'{rootname}.{num:d}.png', 'PNG')
-        return f'{rootname}.*.png'
-    else:
-        pages[0].save(f'{rootname}.png', 'PNG')
-        return f'{rootname}.png'
+            tree.write_bytes(f'{rootname}.{num:d}.{extension}', page)
+        return f'{rootname}.*.{extension}'
+    tree.write_bytes(f'{rootname}.{extension}', pages[0])
+    return f'{rootname}.{extension}'
+
+
+def _conversion_settings(dpi: int, box: Tuple[int, int], image_format: str, quality: int) -> str:
+    """ description of the conversion used to identify cached figures """
+    return f"dpi={dpi}:box={box}:format={image_format}:quality={quality}"
+
+
+@instrument.timed('figure conversion')
+def convert_pdf_to_image(fname: str, tree: SourceTree = None, dpi: int = 500,
+                         cache: 'FigureCache' = None, box: Tuple[int, int] = FIGURE_BOX,
+                         image_format: str = 'PNG', quality: int = 85) -> str:
+    """ Convert image from PDF to png (or jpeg, webp).
+
+    The new image is stored with the original one. The resolution is the
+    largest one (up to `dpi`) at which all the pages fit in `box`, from the
+    page sizes in the PDF. When the sizes are not found, the pages are
+    rendered at the width of `box` and shrunk to fit in it.
+
+    :param fname: file to potentially convert
+    :param tree: source tree containing the file (default on disk)
+    :param dpi: (maximum) resolution of the conversion
+    :param cache: optional :class:`arxiv_on_deck_2.figure_cache.FigureCache`
+    :param box: maximum (width, height) in pixels of the pages (None for a fixed dpi)
+    :param image_format: output format (PNG, JPEG, WEBP)
+    :param quality: quality of the JPEG and WEBP outputs
+    """
+    from pdf2image import convert_from_path, convert_from_bytes
+    tree = as_source_tree(tree)
+    local = tree.local_path(fname)
+    data = tree.read_bytes(fname)
+    settings = _conversion_settings(dpi, box, image_format, quality)
+    pages = cache.get(data, 'pdf', settings) if cache is not None else None
+    if pages is None:
+        options = dict(dpi=dpi)
+        if box is not None:
+            sizes = get_pdf_page_sizes(data)
+            if sizes:
+                options['dpi'] = min(fit_dpi(size, box, max_dpi=dpi) for size in sizes)
+            else:
+                options['size'] = (box[0], None)
+        if local is not None:
+            images = convert_from_path(local, use_cropbox=True, **options)
+        else:
+            images = convert_from_bytes(data, use_cropbox=True, **options)
+        if 'size' in options:
+            for image in images:
+                image.thumbnail(box)
+        pages = [_encode_image(image, image_format, quality) for image in images]
+        if cache is not None:
+            cache.put(data, 'pdf', settings, pages)
+    rootname = fname.replace('.pdf', '')
+    return _store_pages(tree, rootname, pages, _IMAGE_EXTENSIONS[image_format])
 
 
-def open_eps(filename, dpi=300.0):
+def open_eps(filename, dpi=300.0, box: Tuple[int, int] = None):
+    """ Open an EPS image at the given resolution
+
+    :param filename: file (or file object) to open
+    :param dpi: (maximum) resolution
+    :param box: maximum (width, height) in pixels (None for a fixed dpi)
+    :return: PIL image (with the resolution used in `info['dpi']`)
+    """
     from PIL import Image
     # from PIL import EpsImagePlugin
     import math
     img = Image.open(filename)
+    # size from the BoundingBox in points
     original = [float(d) for d in img.size]
+    if box is not None:
+        dpi = fit_dpi(original, box, max_dpi=dpi)
     # scale = width / original[0] # calculated wrong height
     scale = dpi / 72.0            # this fixed it
     if dpi > 0:
         img.load(scale = math.ceil(scale))
     if scale != 1:
-        img.thumbnail([round(scale * d) for d in original], Image.ANTIALIAS)
+        img.thumbnail([round(scale * d) for d in original], Image.LANCZOS)
+    img.info['dpi'] = (dpi, dpi)
     return img
 
 
-def convert_eps_to_image(fname: str) -> str:
-    """ Convert image from EPS to png.
+@instrument.timed('figure conversion')
+def convert_eps_to_image(fname: str, tree: SourceTree = None, dpi: int = 500,
+                         cache: 'FigureCache' = None, box: Tuple[int, int] = FIGURE_BOX,
+                         image_format: str = 'PNG', quality: int = 85) -> str:
+    """ Convert image from EPS to png (or jpeg, webp).
 
-    The new image is stored with the original one
+    The new image is stored with the original one. The resolution is the
+    largest one (up to `dpi`) at which the BoundingBox fits in `box`.
 
     :param fname: file to potentially convert
+    :param tree: source tree containing the file (default on disk)
+    :param dpi: (maximum) resolution of the conversion
+    :param cache: optional :class:`arxiv_on_deck_2.figure_cache.FigureCache`
+    :param box: maximum (width, height) in pixels (None for a fixed dpi)
+    :param image_format: output format (PNG, JPEG, WEBP)
+    :param quality: quality of the JPEG and WEBP outputs
     """
-    from PIL import Image
+    from io import BytesIO
+    tree = as_source_tree(tree)
+    local = tree.local_path(fname)
+    data = tree.read_bytes(fname)
+    settings = _conversion_settings(dpi, box, image_format, quality)
+    pages = cache.get(data, 'eps', settings) if cache is not None else None
+    if pages is None:
+        img = open_eps(local if local is not None else BytesIO(data), dpi=dpi, box=box)
+        pages = [_encode_image(img, image_format, quality, dpi=img.info['dpi'])]
+        if cache is not None:
+            cache.put(data, 'eps', settings, pages)
     rootname = fname.replace('.eps', '')
-    open_eps(fname, dpi=500).save(f'{rootname}.png', format='PNG', dpi=[500, 500])
-    return f'{rootname}.png'
+    return _store_pages(tree, rootname, pages, _IMAGE_EXTENSIONS[image_format])
 
 
 def find_graphics(where: str, image: str, folder: str = '',
-                  attempt_recover_extension: bool = True) -> str:
+                  attempt_recover_extension: bool = True,
+                  tree: SourceTree = None) -> str:
     """ Find graphics files for the figure if graphicspath provided """
+    tree = as_source_tree(tree)
     for wk in where:
         fname = os.path.join(folder, wk, image)
-        if os.path.exists(fname):
+        if tree.exists(fname):
             return fname
     if attempt_recover_extension:
         warnings.warn(LatexWarning(f'attempting recovering figure {image}'))
         for extension in ['.png', '.jpg', '.jpeg', '.pdf', '.eps']:
             for wk in where:
                 fname = os.path.join(folder, wk, image + f'{extension}')
-                if os.path.exists(fname):
+                if tree.exists(fname):
                     warnings.warn(LatexWarning(f'Recovered figure {image} as {fname}'))
                     return fname
     raise FileNotFoundError(f"Could not find figure {image}")
@@ -230,10 +482,32 @@ class LatexFigure(dict):
     - label: figure label
     - images: list of images
 
+    PDF and EPS images are converted to PNG on demand (see :meth:`rasterize`),
+    so that figures that are not selected are never converted.
+
+    :param tree: source tree containing the images (default on disk)
+    :param cache: optional :class:`arxiv_on_deck_2.figure_cache.FigureCache`
+                  of the converted images
+    :param options: conversion options (dpi, box, image_format, quality, see
+                    :func:`convert_pdf_to_image`)
     """
-    def __init__(self, **data):
+    def __init__(self, tree: SourceTree = None, cache: 'FigureCache' = None,
+                 options: dict = None, **data):
         super().__init__(data)
-        self._check_eps_pdf_figure()
+        self.tree = tree
+        self.cache = cache
+        self.options = options or {}
+        self.rasterized = False
+
+    def rasterize(self) -> 'LatexFigure':
+        """ Convert the PDF and EPS images to PNG if not done yet
+
+        :return: the figure itself
+        """
+        if not self.rasterized:
+            self._check_eps_pdf_figure()
+            self.rasterized = True
+        return self
 
     def _check_images_path(self):
         """ Check if images are in the same folder as the document """
@@ -249,9 +523,11 @@ class LatexFigure(dict):
         new_images = []
         for image in images:
             if image[-4:] == '.pdf':
-                new_images.append(convert_pdf_to_image(image))
+                new_images.append(convert_pdf_to_image(image, tree=self.tree, cache=self.cache,
+                                                       **self.options))
             elif image[-4:] == '.eps':
-                new_images.append(convert_eps_to_image(image))
+                new_images.append(convert_eps_to_image(image, tree=self.tree, cache=self.cache,
+                                                       **self.options))
             else:
                 new_images.append(image)
         self['images'] = new_images
@@ -261,6 +537,7 @@ class LatexFigure(dict):
 
         :return: markdown text
         """
+        self.rasterize()
         if (len(self['images']) > 1):
             width = 100 // len(self['images'])
             num = self['num']
@@ -281,18 +558,45 @@ class LatexFigure(dict):
         return Markdown(self.generate_markdown_text())._repr_markdown_()
 
 
+_REFERENCE_COMMANDS = re.compile(r'\\(?:ref|cref|Cref|autoref)\*?\s*\{([^{}]*)\}')
+
+
+def get_reference_counts(source: str) -> dict:
+    """ Number of references to each label in a latex source
+
+    References are made with \\ref, \\cref, \\Cref and \\autoref (the cleveref
+    commands accept comma separated lists of labels). The label definitions
+    themselves are not counted.
+
+    :param source: latex source
+    :return: number of references of each label
+    """
+    counts = {}
+    for match in _REFERENCE_COMMANDS.finditer(source):
+        for label in match.group(1).split(','):
+            label = label.strip()
+            if label:
+                counts[label] = counts.get(label, 0) + 1
+    return counts
+
+
 def select_most_cited_figures(figures: Sequence[LatexFigure],
                               content: dict,
                               N: int = 3) -> Sequence[LatexFigure]:
     """ Finds the number of references to each figure and select the N most cited ones
 
     :param figures: list of all figures
-    :param content: paper content from TexSoup
+    :param content: paper content from TexSoup (or number of references of each label,
+                    see :func:`get_reference_counts`)
     :param N: number of figures to select
     :return: list of selected figures
     """
     # Find the number of references to each figure
-    sorted_figures = sorted([(content.text.count(fig['label']), fig) for fig in figures],
+    if isinstance(content, Mapping):
+        counts = content
+    else:
+        counts = get_reference_counts(str(content))
+    sorted_figures = sorted([(counts.get(fig['label'], 0), fig) for fig in figures],
                             key=lambda x: x[0], reverse=True)
     # make sure there is a detected image
     sorted_figures = [(k, v) for k, v in sorted_figures if v['images'] not in ('', [''], None)]
@@ -301,6 +605,31 @@ def select_most_cited_figures(figures: Sequence[LatexFigure],
     return selected_figures
 
 
+def rasterize_figures(figures: Sequence[LatexFigure], workers: int = None) -> Sequence[LatexFigure]:
+    """ Convert the PDF and EPS images of figures concurrently
+
+    The conversions run in external programs (poppler, ghostscript), hence
+    a pool of threads is enough to run them in parallel.
+
+    :param figures: figures to convert (see :meth:`LatexFigure.rasterize`)
+    :param workers: maximum number of concurrent conversions (default number of CPUs)
+    :return: the figures
+    """
+    pending = [fig for fig in figures if not fig.rasterized]
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if workers <= 1:
+        for fig in pending:
+            fig.rasterize()
+        return figures
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # keep the instrumentation context (current paper) in the threads
+        futures = [executor.submit(contextvars.copy_context().run, fig.rasterize)
+                   for fig in pending]
+        for future in futures:
+            future.result()
+    return figures
+
+
 def get_arxivertag(source: str) -> list:
     """ Retrieve the arxiver tag if any
 
@@ -321,20 +650,166 @@ def get_arxivertag(source: str) -> list:
         return []
 
 
-def clear_latex_comments(data: str) -> str:
+# special characters: latex macro -> unicode
+# (\^{i} and \^{e} are not included: their former regular expressions never matched)
+SPECIAL_CHARACTERS = [
+    (r'\~{n}', r'ñ'),
+    (r'\~{o}', r'õ'),
+    (r'\~{a}', r'ã'),
+    (r"\`{a}", r'à'),
+    (r"\`{e}", r'è'),
+    (r"\`{i}", r'ì'),
+    (r"\`{o}", r'ò'),
+    (r"\`{u}", r'ù'),
+    (r"\'{a}", r'á'),
+    (r"\'{e}", r'é'),
+    (r"\'{i}", r'í'),
+    (r"\'{o}", r'ó'),
+    (r"\'{u}", r'ú'),
+    (r'\"{u}', r'ü'),
+    (r'\"{o}', r'ö'),
+    (r'\"{a}', r'ä'),
+    (r'\"{e}', r'ë'),
+    (r'\"{i}', r'ï'),
+    (r'\c{c}', r'ç'),
+    (r"\'{\i}", r'í'),
+    (r"\`{\i}", r'ì'),
+    (r"\AA", r'Å'),
+]
+
+
+class SpecialCharactersReplacer:
+    """ Replace latex macros of special characters in a single pass
+
+    The macros are also replaced without braces and in capital letters.
+    Macros are tried in the order of the table at each position, which gives the
+    same result as substituting them one after the other.
+
+    :param which: list of (macro, unicode character)
+    """
+    def __init__(self, which: Sequence[tuple]):
+        # add those without the {}
+        which = list(which) + [(k.replace('{', '').replace('}', ''), v) for k, v in which]
+        # add capital letters too
+        which = which + [(k.upper(), v.upper()) for k, v in which]
+        self.table = {}
+        for from_, to_ in which:
+            self.table.setdefault(from_, to_)
+        self.pattern = re.compile('|'.join(re.escape(k) for k in self.table))
+
+    def _replace(self, match: re.Match) -> str:
+        return self.table[match.group(0)]
+
+    def __call__(self, source: str) -> str:
+        if '\\' not in source:
+            return source
+        return self.pattern.sub(self._replace, source)
+
+
+_replace_document_characters = SpecialCharactersReplacer(SPECIAL_CHARACTERS + [(r"\degr", r'◦')])
+_replace_bibitem_characters = SpecialCharactersReplacer(SPECIAL_CHARACTERS)
+
+
+def replace_special_characters(source: str, degree: bool = True) -> str:
+    """ Replace latex macros of special characters (accents etc) for their unicode alternatives
+
+    :param source: text to transform
+    :param degree: set to also replace `\\degr`
+    :return: transformed text
+    """
+    if degree:
+        return _replace_document_characters(source)
+    return _replace_bibitem_characters(source)
+
+
+_TRAILING_SPACES = re.compile(r'\s+\n')
+_FORCED_SPACES = re.compile(r'\\\{\}|\{\}|\\\s|\\,')
+_PLOTONE = re.compile(r'\\plotone\{(.*)\}')
+_PLOTTWO = re.compile(r'\\plottwo\{(.*)\}\{(.*)\}')
+_DEF_COMMAND = re.compile(r'(\\.{0,1}def)(.[\w]*)({.*})')
+
+
+# verbatim-like environments: comments are not stripped inside (or the full content for `comment`)
+VERBATIM_ENVIRONMENTS = ('verbatim', 'verbatim*', 'Verbatim', 'lstlisting', 'minted', 'comment')
+
+_COMMENT_SCANNER = re.compile(
+    r'(?P<verb>\\verb\*?(?P<delim>[^\sa-zA-Z*]).*?(?P=delim))'
+    r'|\\begin\{(?P<env>' + '|'.join(re.escape(k) for k in VERBATIM_ENVIRONMENTS) + r')\}'
+    r'|(?<!\\)(?:\\\\)*(?P<comment>%)')
+
+
+def strip_latex_comments(lines: Iterable[str]) -> Iterator[str]:
+    r""" Remove the comments from lines of latex source
+
+    Works in a streaming way (e.g. over an open file) and in linear time.
+    Escaped percent signs (`\%`, but not `\\%`) and `\verb` content are kept;
+    `verbatim`-like environments are left untouched and the content of
+    `comment` environments is removed. Lines are yielded without line ending,
+    one for each input line.
+
+    :param lines: iterable of lines (with or without line ending)
+    :return: iterator over the lines without comments
+    """
+    end = None          # closing of the current verbatim-like environment
+    dropping = False    # inside a comment environment
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if (end is None) and ('%' not in line) and ('\\begin' not in line):
+            yield line
+            continue
+        parts = []
+        pos = 0
+        while True:
+            if end is not None:
+                stop = line.find(end, pos)
+                if stop < 0:
+                    if not dropping:
+                        parts.append(line[pos:])
+                    break
+                stop += len(end)
+                if not dropping:
+                    parts.append(line[pos:stop])
+                pos, end, dropping = stop, None, False
+                continue
+            # fast path: first unescaped % without \verb or \begin before it
+            start = line.find('%', pos)
+            while start > pos:
+                escape = start
+                while escape > pos and line[escape - 1] == '\\':
+                    escape -= 1
+                if (start - escape) % 2 == 0:
+                    break
+                start = line.find('%', start + 1)
+            if ((start >= 0) and (line.find('\\verb', pos, start) < 0)
+                    and (line.find('\\begin', pos, start) < 0)):
+                parts.append(line[pos:start])
+                break
+            match = _COMMENT_SCANNER.search(line, pos)
+            while (match is not None) and match.group('verb'):
+                match = _COMMENT_SCANNER.search(line, match.end())
+            if match is None:
+                parts.append(line[pos:])
+                break
+            if match.group('comment'):
+                parts.append(line[pos:match.start('comment')])
+                break
+            env = match.group('env')
+            dropping = env == 'comment'
+            parts.append(line[pos:match.start() if dropping else match.end()])
+            end = '\\end{' + env + '}'
+            pos = match.end()
+        yield ''.join(parts)
+
+
+def clear_latex_comments(data: Union[str, Iterable[str]]) -> str:
     """ clean text from any comment
 
-    :param data: text to clean
+    :param data: text to clean (or iterable of lines, e.g. an open file)
     :return: cleaned text
     """
-    lines = []
-    for line in data.splitlines():
-        try:
-            start = list(re.compile(r'(?<!\\)%').finditer(line))[0].span()[0]
-            lines.append(line[:start])
-        except IndexError:
-            lines.append(line)
-    return '\n'.join(lines)
+    if isinstance(data, str):
+        data = data.splitlines()
+    return '\n'.join(strip_latex_comments(data))
 
 
 def fix_def_command(text: str) -> str:
@@ -346,9 +821,8 @@ def fix_def_command(text: str) -> str:
     https://github.com/alvinwan/TexSoup/issues/131
 
     '''
-    search_def_gdef = re.compile(r'(\\.{0,1}def)(.[\w]*)({.*})')
     try:
-        pre, name, content = search_def_gdef.findall(text)[0]
+        pre, name, content = _DEF_COMMAND.findall(text)[0]
         if name.startswith('{') or name.startswith('\\'):
             if name.startswith('{') and name.endswith('}'):
                 text_ = ''.join([pre, name, content])
@@ -393,34 +867,163 @@ def force_macros_mathmode(text: str, macros: Sequence[str]) -> str:
     return text_
 
 
-def inject_other_sources(maintex:str ,
-                         texfiles: Sequence[str],
-                         verbose: bool = False):
-    """ replace input and include commands by the content of the sub-files """
+class IncludeResolver:
+    r""" Replace `\input` and `\include` commands by the content of the sub-files
 
-    # find all include and input commands
+    The tex files of the tree are indexed once by relative path and by
+    basename, included files are resolved recursively (an include cycle is
+    reported and left as is), and file contents are read only once.
+    Commands in comments are ignored.
+
+    The resolver keeps a source map of the last flattened document to
+    locate any offset of the output in the original files (see :meth:`locate`).
+
+    :param tree: source tree containing the files (default on disk)
+    :param texfiles: list of the tex files available (default all tex files of the tree)
+    :param verbose: set to warn about each injection
+    """
     include_regex = re.compile(r'(?:(?<=[^$]))\\(?:input|include)\{(.*?)\}')
-    # important to start from the end to avoid breaking the span indices
-    externals = reversed(list(include_regex.finditer(maintex)))
-
-    # the following matches the full filenames without extensions
-    for match in externals:
-        ext = match.group(1).replace('"', '').replace("'", '')
-        ext_ = os.path.splitext(os.path.basename(ext))[0]
-        for subsource in texfiles:
-            sub_ = os.path.splitext(os.path.basename(subsource))[0]
-            if ext_ == sub_:
-                if verbose:
-                    warnings.warn(LatexWarning(f"Latex injecting: '{ext}' from '{subsource}'"))
-                with open(subsource, 'r') as fsub:
-                    subtext = fsub.read()
-                s, e = match.span()
-                maintex = ''.join([
-                    maintex[:s],
-                    '% ', maintex[s: e], ' % -- REPLACED BY LATEX INJECTION -- \n',
-                    subtext,
-                    maintex[e:]])
-    return maintex
+
+    def __init__(self, tree: SourceTree = None, texfiles: Sequence[str] = None,
+                 verbose: bool = False):
+        self.tree = as_source_tree(tree)
+        if texfiles is None:
+            texfiles = self.tree.glob("**/*.tex")
+        self.texfiles = [str(k) for k in texfiles]
+        self.verbose = verbose
+        self.source_map = []
+        self._contents = {}
+        self._lines = {}
+        self._by_path = {}
+        self._by_name = {}
+        for fname in self.texfiles:
+            relative = self.tree.relative_path(fname)
+            self._by_path.setdefault(relative, fname)
+            self._by_path.setdefault(os.path.splitext(relative)[0], fname)
+            self._by_name.setdefault(os.path.splitext(os.path.basename(fname))[0], fname)
+
+    def read(self, fname: str) -> str:
+        """ Content of a file (read once)
+
+        :param fname: file of the tree
+        :return: text content
+        """
+        if fname not in self._contents:
+            self._contents[fname] = self.tree.read_text(fname)
+        return self._contents[fname]
+
+    def resolve(self, name: str) -> Union[str, None]:
+        """ File of the tree referenced by an include command
+
+        Tries the path relative to the root of the tree (with and without
+        extension), then any file with the same basename.
+
+        :param name: argument of the include command
+        :return: file name or None if not found
+        """
+        name = name.replace('"', '').replace("'", '').strip()
+        if not name:
+            return None
+        relative = posixpath.normpath(name.replace('\\', '/'))
+        for key in (relative, os.path.splitext(relative)[0]):
+            if key in self._by_path:
+                return self._by_path[key]
+        return self._by_name.get(os.path.splitext(os.path.basename(relative))[0])
+
+    @staticmethod
+    def _is_commented(text: str, position: int) -> bool:
+        """ Check if a position of the text is after a comment sign on its line """
+        start = text.rfind('\n', 0, position) + 1
+        if '%' not in text[start:position]:
+            return False
+        prefix = text[start:position]
+        return len(next(strip_latex_comments([prefix]))) < len(prefix)
+
+    def _append(self, parts: list, chunk: str, origin: str, offset: int, copied: bool = True):
+        """ add a chunk to the output and to the source map """
+        if not chunk:
+            return
+        self.source_map.append((self._length, origin, offset, copied))
+        parts.append(chunk)
+        self._length += len(chunk)
+
+    def _inject(self, text: str, origin: str, stack: tuple, parts: list):
+        """ flatten a text recursively into parts """
+        pos = 0
+        for match in self.include_regex.finditer(text):
+            s, e = match.span()
+            if self._is_commented(text, s):
+                continue
+            ext = match.group(1)
+            fname = self.resolve(ext)
+            if fname is None:
+                continue
+            if fname in stack:
+                warnings.warn(LatexWarning(
+                    f"Latex injection cycle: '{ext}' in '{origin}' includes '{fname}' again"))
+                continue
+            if self.verbose:
+                warnings.warn(LatexWarning(
+                    f"Latex injecting: '{ext}' from '{fname}' "
+                    f"(in {origin}:{self.line_number(origin, s)})"))
+            self._append(parts, text[pos:s], origin, pos)
+            self._append(parts, ''.join(['% ', text[s: e], ' % -- REPLACED BY LATEX INJECTION -- \n']),
+                         origin, s, copied=False)
+            self._inject(self.read(fname), fname, stack + (fname,), parts)
+            pos = e
+        self._append(parts, text[pos:], origin, pos)
+
+    @instrument.timed('injection')
+    def inject(self, maintex: str, main_file: str = None) -> str:
+        """ Flatten a document
+
+        :param maintex: source of the main document
+        :param main_file: name of the main document (for the source map)
+        :return: the source with included files injected
+        """
+        origin = main_file if main_file is not None else '<main>'
+        self._contents[origin] = maintex
+        self.source_map = []
+        self._length = 0
+        parts = []
+        self._inject(maintex, origin, (origin,), parts)
+        instrument.add(nbytes=self._length, count=len(self.source_map))
+        return ''.join(parts)
+
+    def line_number(self, fname: str, offset: int) -> int:
+        """ Line number (starting at 1) of an offset in a file """
+        if fname not in self._lines:
+            text = self._contents.get(fname, '')
+            self._lines[fname] = [k.start() for k in re.finditer('\n', text)]
+        return bisect.bisect_left(self._lines[fname], offset) + 1
+
+    def locate(self, offset: int) -> Union[tuple, None]:
+        """ Original file and line of an offset in the last flattened document
+
+        :param offset: position in the flattened document
+        :return: (file name, line number) or None if out of range
+        """
+        if not self.source_map or offset < 0 or offset >= self._length:
+            return None
+        index = bisect.bisect_right(self.source_map, (offset, chr(0x10ffff))) - 1
+        start, origin, origin_offset, copied = self.source_map[index]
+        if copied:
+            origin_offset += offset - start
+        return origin, self.line_number(origin, origin_offset)
+
+
+def inject_other_sources(maintex:str ,
+                         texfiles: Sequence[str],
+                         verbose: bool = False,
+                         tree: SourceTree = None):
+    """ replace input and include commands by the content of the sub-files
+
+    :param maintex: source of the main document
+    :param texfiles: list of the tex files available
+    :param verbose: set to warn about each injection
+    :param tree: source tree containing the files (default on disk)
+    """
+    return IncludeResolver(tree, texfiles, verbose=verbose).inject(maintex)
 
 
 def get_content_per_section(source: str, flexible:bool = True, verbose: bool = True) -> Sequence:
@@ -475,44 +1078,279 @@ def get_content_per_section(source: str, flexible:bool = True, verbose: bool = T
 
 
 
-def get_content(source: str, flexible:bool = True, verbose:bool = False) -> TexNode:
-    # flexible=True, current_attempt=0, max_attempt=10) -> str:
+_DOCUMENT_MARKERS = re.compile(r'\\(?:begin|end)\{document\}')
+_SECTION_START = re.compile(r'\s*\\(?:sub)*section\*?\s*[\[{]')
+_BALANCE_TOKENS = re.compile(r'\\(begin|end)\{([^}]*)\}|\\[\[\]]|\\.|[{}$]', re.DOTALL)
+
+
+def _balanced_split_points(lines: Sequence[str]) -> Sequence[int]:
+    """ Line indices after which braces, environments and math modes are all closed
+
+    Sectioning commands always start a new span, so that an unbalanced line
+    does not prevent splitting the rest of the document.
+    """
+    points = []
+    env = brace = display = 0
+    inline = False
+    for num, line in enumerate(lines, 1):
+        if _SECTION_START.match(line):
+            env = brace = display = 0
+            inline = False
+            if num > 1 and (not points or points[-1] != num - 1):
+                points.append(num - 1)
+        for match in _BALANCE_TOKENS.finditer(line):
+            token = match.group()
+            if match.group(1):
+                if match.group(2) != 'document':
+                    env = max(0, env + (1 if match.group(1) == 'begin' else -1))
+            elif token == '\\[':
+                display += 1
+            elif token == '\\]':
+                display = max(0, display - 1)
+            elif token == '{':
+                brace += 1
+            elif token == '}':
+                brace = max(0, brace - 1)
+            elif token == '$':
+                inline = not inline
+        if not (env or brace or display or inline):
+            points.append(num)
+    return points
+
+
+def _nearest_split_point(points: Sequence[int], lo: int, hi: int) -> int:
+    """ Split point strictly between lo and hi closest to the middle (middle if none) """
+    middle = (lo + hi) // 2
+    index = bisect.bisect_left(points, middle)
+    candidates = [points[k] for k in (index - 1, index) if 0 <= k < len(points)]
+    candidates = [k for k in candidates if lo < k < hi]
+    if not candidates:
+        return max(lo + 1, middle)
+    return min(candidates, key=lambda k: abs(k - middle))
+
+
+def _section_split_point(sections: Sequence[int], points: Sequence[int], lo: int, hi: int) -> int:
+    """ Section start strictly between lo and hi closest to the middle, balanced split point if none """
+    index = bisect.bisect_right(sections, lo)
+    if (index < len(sections)) and (sections[index] < hi):
+        return _nearest_split_point(sections, lo, hi)
+    return _nearest_split_point(points, lo, hi)
+
+
+def get_content_bisect(source: str, flexible: bool = True, max_attempts: int = None,
+                       verbose: bool = False) -> Tuple[TexNode, Sequence[dict]]:
+    """ Parse a document that TexSoup cannot parse at once by excluding the failing spans
+
+    The source (without the document environment markers) is parsed as a
+    whole first. A failing span is split in two at the section start closest
+    to its middle, or, within a section, at the line closest to its middle
+    where braces, environments and math modes are closed; each half is parsed
+    on its own and split again if it fails, until the failing spans are
+    single lines. Only these minimal spans are excluded, and the total number
+    of parse attempts is bounded (by default logarithmic in the number of
+    lines): when the budget is exhausted, a failing span is excluded as a
+    whole (the halves already pending are still parsed once each, at most one
+    per bisection level).
+
+    :param source: source of the document
+    :param flexible: set to tolerate unclosed environments
+    :param max_attempts: maximum number of bisection parse attempts
+    :param verbose: set to print the dropped spans
+    :return: the content of the parsed spans, and the dropped spans as
+             dict(lines=(first, last) line numbers of the source, size, error, text)
+    """
+    lines = _DOCUMENT_MARKERS.sub('', source).splitlines(keepends=True)
+    points = _balanced_split_points(lines)
+    # failing spans are split between sections first
+    sections = [num for num, line in enumerate(lines)
+                if num and _SECTION_START.match(line)]
+    if max_attempts is None:
+        max_attempts = 4 * (math.ceil(math.log2(len(lines) + 1)) + 1)
+    attempts = 0
+    parsed = []
+    dropped = []
+
+    def parse(lo: int, hi: int):
+        nonlocal attempts
+        text = ''.join(lines[lo:hi])
+        if not text.strip():
+            return
+        attempts += 1
+        try:
+            parsed.append(TexSoup(text, tolerance=int(flexible)))
+            return
+        except Exception as e:
+            error = e
+        if (hi - lo == 1) or (attempts >= max_attempts):
+            dropped.append(dict(lines=(lo + 1, hi), size=len(text), error=str(error), text=text))
+            if verbose:
+                print(f"✘ lines {lo + 1}-{hi}: {error}")
+            return
+        mid = _section_split_point(sections, points, lo, hi)
+        parse(lo, mid)
+        parse(mid, hi)
+
+    parse(0, len(lines))
+    if not parsed:
+        raise RuntimeError("Could not parse any part of the document.")
+    if dropped:
+        where = ', '.join(f"{a}-{b}" for (a, b) in (k['lines'] for k in dropped))
+        warnings.warn(LatexWarning(
+            f"Dropped {len(dropped)} span(s) ({sum(k['size'] for k in dropped):,d} characters) "
+            f"after {attempts} parse attempts: lines {where}"))
+    final = parsed[0]
+    final.append(*list(chain(*[bk.expr._contents for bk in parsed[1:]])))
+    return final, dropped
+
+
+@instrument.timed('texsoup parse')
+def get_content(source: str, flexible:bool = True, verbose:bool = False,
+                dropped: list = None) -> TexNode:
     """ get soup to parse the source and try to recover if something goes wrong.
 
     As we do not need the exact text throughout the paper, we can try to isolate potential error sections.
-    The following attempts to remove the line that triggers an error.
+    The recovery excludes the minimal spans that trigger errors (see :func:`get_content_bisect`).
+
+    :param source: source of the document
+    :param flexible: set to tolerate unclosed environments
+    :param verbose: set to print the dropped spans
+    :param dropped: list extended with the spans dropped by the recovery if any
+    :return: the document content
     """
     try:
         return TexSoup(source, tolerance=int(flexible))
     except:
         warnings.warn(LatexWarning(f"Error parsing the document directly. Trying to recover."))
-        return get_content_per_section(source, flexible=flexible, verbose=verbose)[0]
+        content, spans = get_content_bisect(source, flexible=flexible, verbose=verbose)
+        if dropped is not None:
+            dropped.extend(spans)
+        return content
+
+
+# commands and environments used by LatexDocument (see `extract_fragments`)
+FRAGMENT_COMMANDS = ('title', 'subtitle', 'author', 'abstract', 'graphicspath', 'bibliography',
+                     'newcommand', 'renewcommand', 'providecommand', 'def', 'gdef')
+FRAGMENT_ENVIRONMENTS = ('abstract', 'figure', 'figure*')
+
+_FRAGMENT_SCANNER = re.compile(
+    r'\\(?:begin\{(?P<env>' + '|'.join(re.escape(k) for k in FRAGMENT_ENVIRONMENTS) + r')\}'
+    r'|(?P<command>' + '|'.join(FRAGMENT_COMMANDS) + r')(?![a-zA-Z@]))')
+_BRACES = re.compile(r'\\.|[{}]', re.DOTALL)
+# arguments may be separated by spaces and at most one line break
+_ARGUMENT_START = re.compile(r'[ \t]*(?:\n[ \t]*)?(?:\{|\[|#[0-9])')
+_MACRO_NAME = re.compile(r'[ \t]*(?:\n[ \t]*)?\\[a-zA-Z@]+')
+_MACRO_DEFINITIONS = ('newcommand', 'renewcommand', 'providecommand', 'def', 'gdef')
+
+
+def _find_group_end(source: str, start: int) -> int:
+    """ Position after the brace group starting at `start` (-1 if not closed) """
+    depth = 0
+    for match in _BRACES.finditer(source, start):
+        char = match.group()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return -1
+
+
+def _find_arguments_end(source: str, pos: int, required: int = 1,
+                        max_optional: int = 1000) -> int:
+    """ Position after the arguments (brackets, #n and `required` brace groups) following a command """
+    while required > 0:
+        match = _ARGUMENT_START.match(source, pos)
+        if match is None:
+            return pos
+        start = match.end() - 1
+        char = source[start]
+        if char == '{':
+            end = _find_group_end(source, start)
+            required -= 1
+        elif char == '[':
+            end = source.find(']', start, start + max_optional)
+            end = -1 if end < 0 else end + 1
+        else:
+            end = match.end()
+        if end < 0:
+            return pos
+        pos = end
+    return pos
+
+
+def _find_environment_end(source: str, pos: int, env: str) -> int:
+    r""" Position after the `\end` closing an environment (end of source if not closed) """
+    pattern = re.compile(r'\\(begin|end)\{' + re.escape(env) + r'\}')
+    depth = 1
+    for match in pattern.finditer(source, pos):
+        depth += 1 if match.group(1) == 'begin' else -1
+        if depth == 0:
+            return match.end()
+    return len(source)
+
+
+@instrument.timed('fragments')
+def extract_fragments(source: str) -> Sequence[str]:
+    r""" Extract the parts of a document used by :class:`LatexDocument`
+
+    Scans the source once and keeps only the commands (with their
+    arguments) and environments listed in `FRAGMENT_COMMANDS` and
+    `FRAGMENT_ENVIRONMENTS` (title, authors, abstract, figures,
+    graphicspath, bibliography and macro definitions), so that TexSoup only
+    parses these small fragments. Commands nested in a kept fragment stay in
+    that fragment.
+
+    :param source: cleaned source of the document
+    :return: the fragments in order of appearance
     """
-    except EOFError as error:
-        # End of document error. split around the offending line and try again
-        if (current_attempt >= max_attempt) or not flexible:
-            raise error
-        offset = int(re.findall(r'\[.* Off.* ([0-9]*)\]', str(error))[0])
-        newsource = source.splitlines()
-        a = TexSoup('\n'.join(newsource[:64]) + '\n\end{document}')
-        b = TexSoup('\n'.join(newsource[65:]))  # no need to begin{document}
-        a.append(*b)
-        return a
-    except TypeError as e:
-        error = e
-        offset = int(re.findall(r'\[.* Off.* ([0-9]*)\]', str(error))[0])
-        error_at_line = source[:offset].count('\n')
-        warnings.warn(LatexWarning(f"error at line {error_at_line:,d}"))
-        if not flexible:
-            raise e
-
-        newsource = source.splitlines()
-        newsource = newsource[:error_at_line] + newsource[error_at_line + 1:]
-        return get_content('\n'.join(newsource),
-                           flexible=current_attempt < max_attempt,
-                           current_attempt= current_attempt + 1,
-                           max_attempt=max_attempt)
-        """
+    instrument.add(nbytes=len(source))
+    fragments = []
+    pos = 0
+    while True:
+        match = _FRAGMENT_SCANNER.search(source, pos)
+        if match is None:
+            break
+        if match.group('env'):
+            end = _find_environment_end(source, match.end(), match.group('env'))
+        else:
+            end = match.end()
+            required = 1
+            if match.group('command') in _MACRO_DEFINITIONS:
+                # \newcommand\name{...} or \def\name{...} (name without braces)
+                name = _MACRO_NAME.match(source, end)
+                if name:
+                    end = name.end()
+                else:
+                    # \newcommand{\name}[n][default]{...} or fixed \def{\name}{...}
+                    required = 2
+            end = _find_arguments_end(source, end, required=required)
+        fragments.append(source[match.start():end])
+        pos = end
+    instrument.add(count=len(fragments))
+    return fragments
+
+
+@instrument.timed('texsoup parse')
+def get_fragments_content(fragments: Sequence[str], flexible: bool = True) -> TexNode:
+    """ Parse fragments separately and gather them in one document
+
+    Fragments that cannot be parsed are skipped with a warning.
+
+    :param fragments: latex fragments (see :func:`extract_fragments`)
+    :param flexible: set to tolerate unclosed environments
+    :return: the document content
+    """
+    content = TexSoup('', tolerance=int(flexible))
+    for fragment in fragments:
+        try:
+            parsed = TexSoup(fragment, tolerance=int(flexible))
+        except Exception as e:
+            warnings.warn(LatexWarning(f"Skipping fragment that cannot be parsed ({e}): "
+                                       f"{fragment[:80]}"))
+            continue
+        content.append(*parsed.expr._contents)
+    return content
 
 
 class LatexDocument:
@@ -520,17 +1358,43 @@ class LatexDocument:
 
     Allows to extract title, authors, figures, abstract
 
-    :param folder: folder containing the document
+    :param folder: folder containing the document, or in-memory source tree
+                   (mapping of file names to content or :class:`SourceTree`)
+    :param validation: check of the source before parsing (raises to stop)
+    :param debug: set to print parsing errors instead of raising them
+    :param parse_cache: optional :class:`arxiv_on_deck_2.parse_cache.ParseCache`
+                        to skip TexSoup for sources already parsed
+    :param engine: 'texsoup' to parse the full document with TexSoup,
+                   'fast' to only parse the fragments used (see :func:`extract_fragments`)
+    :param figure_cache: optional :class:`arxiv_on_deck_2.figure_cache.FigureCache`
+                         of the converted PDF/EPS figures
+    :param figure_workers: number of concurrent figure conversions (default number of CPUs)
+    :param figure_options: conversion options of the figures (dpi, box, image_format, quality,
+                           see :func:`convert_pdf_to_image`)
     :param main_file: name of the main document
     :param content: the document content from TexSoup
     :param title: the title of the paper
     :param authors: the authors of the paper
     :param comments: the comments of the paper
     :param abstract: the abstract of the paper
+    :param dropped: spans of the source excluded by the parsing error recovery
     """
-    def __init__(self, folder: str, validation: callable = None, debug: bool = False):
-        self.main_file = find_main_doc(folder)
-        self.folder = folder
+    def __init__(self, folder: Union[str, Mapping[str, bytes], SourceTree],
+                 validation: callable = None, debug: bool = False,
+                 parse_cache: 'ParseCache' = None, engine: str = 'texsoup',
+                 figure_cache: 'FigureCache' = None, figure_workers: int = None,
+                 figure_options: dict = None):
+        if engine not in ('texsoup', 'fast'):
+            raise ValueError(f"expected engine in ('texsoup', 'fast'). Got {engine}.")
+        self.engine = engine
+        self.figure_cache = figure_cache
+        self.figure_workers = figure_workers
+        self.figure_options = figure_options
+        self.tree = as_source_tree(folder)
+        texfiles = self.get_texfiles()
+        self.includes = IncludeResolver(self.tree, texfiles, verbose=True)
+        self.main_file = find_main_doc(self.tree, texfiles, reader=self.includes)
+        self.folder = self.tree.root
         self._figures = None
         self._abstract = None
         self._title = None
@@ -538,17 +1402,32 @@ class LatexDocument:
         self.comment = None
         self.macros = None
         self.graphicspath = None
+        self.content = None
+        self._structure = None
+        self._reference_counts = None
+        self.dropped = []
 
-        with open(self.main_file, 'r') as fin:
-            source = fin.read()
-        source = inject_other_sources(source, self.get_texfiles(), verbose=True)
+        source = self.includes.inject(self.includes.read(self.main_file), self.main_file)
         if validation is not None:
             validation(source)
         source = self._clean_source(source)
         # self.content = TexSoup(source)
+        structure = None
+        if parse_cache is not None:
+            structure = parse_cache.get(source, variant=engine)
         try:
-            content = get_content(source, flexible=True, verbose=True)
-            self._load_content(content)
+            if structure is not None:
+                self._load_structure(structure)
+            else:
+                content = None
+                if engine == 'fast':
+                    content = self._get_fragments_content(source)
+                if content is None:
+                    content = get_content(source, flexible=True, verbose=True,
+                                          dropped=self.dropped)
+                self._load_content(content)
+                if parse_cache is not None:
+                    parse_cache.put(source, self.extract_structure(), variant=engine)
         except Exception as e:
             if not debug:
                 raise e
@@ -556,98 +1435,114 @@ class LatexDocument:
                 print(e)
         self.source = source
 
+    @staticmethod
+    def _get_fragments_content(source: str) -> Union[TexNode, None]:
+        """ TexSoup content of the fragments of the source (None if they cannot be parsed) """
+        try:
+            return get_fragments_content(extract_fragments(source), flexible=True)
+        except Exception as e:
+            warnings.warn(LatexWarning(f"Could not parse the document fragments ({e}). "
+                                       "Parsing the full document."))
+            return None
+
     def _load_content(self, content):
         self.content = content
         self.macros = self.retrieve_latex_macros()
         self.graphicspath = self.get_graphicspath()
 
-    def get_graphicspath(self) -> Sequence[str]:
-        """Retrieve the graphicspath if declared"""
+    def _load_structure(self, structure: dict):
+        """ Load the structure of a parsed document (see :meth:`extract_structure`) """
+        self.content = None
+        self._structure = structure
+        self.macros = self.retrieve_latex_macros()
+        self.graphicspath = self.get_graphicspath()
+
+    def extract_structure(self) -> dict:
+        """ Structure of the parsed document that does not need the TexSoup content
+
+        Failed extractions are recorded as `{'error': message}` and raised
+        again when the structure is used.
+
+        :return: title, authors, abstract, figures (raw data),
+                 macros, graphicspath and bibliography files
+        """
+        getters = dict(title=self.get_title,
+                       authors=self.get_authors,
+                       abstract=self.get_abstract,
+                       figures=self._get_figures_data,
+                       macros=self.retrieve_latex_macros,
+                       graphicspath=self._get_graphicspath_data,
+                       bibliography=self.get_bibliography_files)
+        structure = {}
+        for name, getter in getters.items():
+            try:
+                structure[name] = getter()
+            except Exception as e:
+                structure[name] = {'error': f"{e.__class__.__name__}: {e}"}
+        return structure
+
+    def _cached(self, name: str):
+        """ Value from the loaded structure (raises if its extraction failed) """
+        value = self._structure[name]
+        if isinstance(value, dict) and ('error' in value):
+            raise RuntimeError(f"Could not extract {name} from {self.main_file}: {value['error']}")
+        return value
+
+    def _get_graphicspath_data(self) -> Sequence[str]:
+        """ directories declared in graphicspath (relative to the document) """
+        if self.content is None:
+            return self._cached('graphicspath')
         # list of directories in {}
         try:
             where = [str(k.string) for k in self.content.find_all('graphicspath')[0].contents]
         except:
             where = ['./']
+        return where
 
-        return [os.path.join(self.folder, k) for k in where]
+    def get_graphicspath(self) -> Sequence[str]:
+        """Retrieve the graphicspath if declared"""
+        return [self.tree.join(k) for k in self._get_graphicspath_data()]
+
+    def get_bibliography_files(self) -> Sequence[str]:
+        """ Names of the bibliography databases declared by the bibliography command """
+        if self.content is None:
+            return self._cached('bibliography')
+        return [str(k) for k in self.content.find_all('bibliography')[0].text]
 
     def get_texfiles(self):
         """ returns all tex files in the folder (and subfolders) """
-        folder = self.folder
-        return [str(k) for k in pathlib.Path(f"{folder}").glob("**/*.tex")]
+        return self.tree.glob("**/*.tex")
 
+    @instrument.timed('clean source')
     def _clean_source(self, source: str) -> str:
         """ Clean the source of the document
 
         :param source: the source to clean
         :return: cleaned source
         """
-        import re
+        instrument.add(nbytes=len(source))
         source = clear_latex_comments(source).replace('$$', '')\
                                              .replace('``', '"')\
                                              .replace("''", '"')
-        source = '\n'.join([fix_def_command(k) for k in source.splitlines() if k])
-        source = re.sub(r'\$\$', r'', source)
-        # source = re.sub(r'\s\s+', ' ', source)
-        source = re.sub(r'\n\n+', r'\n', source)
-        # source = re.sub(r'\n+', r'\n', source)
-        source = re.sub(r'\s+\n', r'\n', source)
-        source = re.sub(r'\{\}', ' ', source)   #empty commands
-        # some people play with $$ within equations...
-        # replace by \[ ... \] and remove isolated $$
-        # source = re.sub(r'(?P<env>(\${2}))(.*)(?P=env)', r'\\[\g<3>\\]', source)
-
-        # source = re.sub(r'(?<!(\s|\^))\$\$(?!(\s|$))', '', source)
-        # often missing spaces around $.
-        # source = re.sub(r'(?<=[^\$])\$(?=[^\$])', ' $ ', source)
-        # \\s and \\, used to force spaces.
-        source = re.sub(r'\\\s', ' ', source)
-        source = re.sub(r'\\,', ' ', source)
+        source = '\n'.join([fix_def_command(k) if 'def' in k else k
+                            for k in source.splitlines() if k])
+        # trailing spaces and empty lines
+        source = _TRAILING_SPACES.sub('\n', source)
+        # empty commands ({}), \\s and \\, used to force spaces.
+        source = _FORCED_SPACES.sub(' ', source)
         # some varied graphics commands that should die.
-        source = re.sub(r'\\plotone\{(.*)\}', r'\\includegraphics{\g<1>}', source)
-        source = re.sub(r'\\plottwo\{(.*)\}\{(.*)\}', r'\\includegraphics{\g<1>}\\includegraphics{\g<2>}', source)
-
+        if '\\plot' in source:
+            source = _PLOTONE.sub(r'\\includegraphics{\g<1>}', source)
+            source = _PLOTTWO.sub(r'\\includegraphics{\g<1>}\\includegraphics{\g<2>}', source)
         # special characters
-        which = [
-            (r'\\~{n}', r'ñ'),
-            (r'\\~{o}', r'õ'),
-            (r'\\~{a}', r'ã'),
-            (r"\\`{a}", r'à'),
-            (r"\\`{e}", r'è'),
-            (r"\\`{i}", r'ì'),
-            (r"\\`{o}", r'ò'),
-            (r"\\`{u}", r'ù'),
-            (r"\\'{a}", r'á'),
-            (r"\\'{e}", r'é'),
-            (r"\\'{i}", r'í'),
-            (r"\\'{o}", r'ó'),
-            (r"\\'{u}", r'ú'),
-            (r'\\"{u}', r'ü'),
-            (r'\\"{o}', r'ö'),
-            (r'\\"{a}', r'ä'),
-            (r'\\"{e}', r'ë'),
-            (r'\\"{i}', r'ï'),
-            (r'\\^{i}', r'î'),
-            (r'\\^{e}', r'ê'),
-            (r'\\c{c}', r'ç'),
-            (r"\\'{\\i}", r'í'),
-            (r"\\`{\\i}", r'ì'),
-            (r"\\AA", r'Å'),
-            (r"\\degr", r'◦'),
-        ]
-
-        # add those without the {}
-        which = which + [(k.replace('{', '').replace('}', ''), v) for k, v in which]
-        # add capital letters too
-        which = which + [(k.upper(), v.upper()) for k, v in which]
-
-        for from_, to_ in which:
-            source = re.sub(from_, to_, source)
+        source = replace_special_characters(source)
         self.source = source
         return source
 
     def retrieve_latex_macros(self) -> Sequence[str]:
         """Get the macros defined in the document """
+        if self.content is None:
+            return self._cached('macros')
 
         keys = (r'providecommand', r'command', r'newcommand',
                 r'renewcommand', r'def', r'gdef')
@@ -683,12 +1578,10 @@ class LatexDocument:
 
         return (required_macros + '\n' + macros_text).splitlines()
 
-    def get_all_figures(self) -> Sequence[LatexFigure]:
-        """ Retrieve all figures (num, images, caption, label) from a document
-
-        :param content: the document content
-        :return: sequence of LatexFigure objects
-        """
+    def _get_figures_data(self) -> Sequence[dict]:
+        """ Raw data of all figures: graphics (as referenced), caption, label """
+        if self.content is None:
+            return self._cached('figures')
         figures = self.content.find_all('figure') + self.content.find_all('figure*')
         if not figures:
             # Falling back into pure regex parsing
@@ -696,16 +1589,9 @@ class LatexDocument:
             results = figure_fallback(self.source)
             figures = TexSoup(results)
             warnings.warn(LatexWarning("Fallback: found " + str(len(results)) + " figures."))
-        folder = self.folder
         data = []
-        for num, fig in enumerate(figures, 1):
-            images = []
-            for k in fig.find_all('includegraphics'):
-                try:
-                    images.append(find_graphics(self.graphicspath, k.text[-1]))
-                except FileNotFoundError:
-                    warnings.warn(LatexWarning(f"Could not find graphic {k}"))
-                    images.append('')
+        for fig in figures:
+            graphics = [(str(k), str(k.text[-1])) for k in fig.find_all('includegraphics')]
             try:
                 caps = fig.find_all('caption')
                 caption = []
@@ -720,10 +1606,38 @@ class LatexDocument:
                 label = [''.join(k.text) for k in fig.find_all('label')][0]
             except IndexError:
                 label = ''
-            fig = LatexFigure(num=num, images=images, caption=caption, label=label)
+            data.append(dict(graphics=graphics, caption=caption, label=label))
+        return data
+
+    def get_all_figures(self) -> Sequence[LatexFigure]:
+        """ Retrieve all figures (num, images, caption, label) from a document
+
+        :return: sequence of LatexFigure objects
+        """
+        data = []
+        for num, fig in enumerate(self._get_figures_data(), 1):
+            images = []
+            for command, image in fig['graphics']:
+                try:
+                    images.append(find_graphics(self.graphicspath, image, tree=self.tree))
+                except FileNotFoundError:
+                    warnings.warn(LatexWarning(f"Could not find graphic {command}"))
+                    images.append('')
+            fig = LatexFigure(num=num, images=images, caption=fig['caption'],
+                              label=fig['label'], tree=self.tree, cache=self.figure_cache,
+                              options=self.figure_options)
             data.append(fig)
         return data
 
+    def get_label_counts(self) -> dict:
+        """ Number of references to each label (figures, tables, sections...) of the document
+
+        The index is built once from the source (see :func:`get_reference_counts`).
+        """
+        if self._reference_counts is None:
+            self._reference_counts = get_reference_counts(self.source)
+        return self._reference_counts
+
     @property
     def figures(self) -> Sequence[LatexFigure]:
         """ All figures from the paper """
@@ -733,6 +1647,8 @@ class LatexDocument:
 
     def get_abstract(self) -> str:
         """ Extract abstract from document """
+        if self.content is None:
+            return self._cached('abstract')
         try:
             abstract = self.content.find_all('abstract')[0]
             # force math around macros
@@ -754,6 +1670,8 @@ class LatexDocument:
 
     def get_title(self) -> str:
         """ Extract document's title """
+        if self.content is None:
+            return self._cached('title')
         # title = ''.join(self.content.find_all('title')[0].contents[-1])
         title = self.content.find_all('title')[0]
         # force math around macros
@@ -783,6 +1701,8 @@ class LatexDocument:
 
     def get_authors(self) -> Sequence[str]:
         """ Get list of authors """
+        if self.content is None:
+            return self._cached('authors')
         authors = []
         author_decl = self.content.find_all('author')
         # parsing multi-author commands (new journal styles)
@@ -842,7 +1762,7 @@ class LatexDocument:
         :param N: number of figures to select
         :return: list of selected figures
         """
-        return select_most_cited_figures(self.figures, self.content)
+        return select_most_cited_figures(self.figures, self.get_label_counts())
     
     def select_arxivertag_figures(self):
         """ Finds the figures references by the arxivertag
@@ -860,10 +1780,23 @@ class LatexDocument:
                     selected.append(fig)
         return selected
 
-    def highlight_authors_in_list(self, hl_list: Sequence[str], verbose: bool = False):
+    def select_figures(self) -> Sequence[LatexFigure]:
+        """ Figures of the summary (arxiver tag, or most cited ones) with converted images
+
+        Only the selected figures are converted (see :func:`rasterize_figures`).
+
+        :return: list of selected figures
+        """
+        selected = self.select_arxivertag_figures()
+        if not selected:
+            selected = self.select_most_cited_figures()
+        return rasterize_figures(selected, workers=self.figure_workers)
+
+    def highlight_authors_in_list(self, hl_list: Union[Sequence[str], AuthorMatcher],
+                                  verbose: bool = False):
         """ highlight all authors of the paper that match `lst` entries
 
-        :param hl_list: list of authors to highlight
+        :param hl_list: list of authors to highlight (or an :class:`AuthorMatcher`)
         :param verbose: display matching information if set
         """
         self._authors = highlight_authors_in_list(self.authors, hl_list, verbose=verbose)
@@ -877,6 +1810,7 @@ class LatexDocument:
 
         return macros_text
 
+    @instrument.timed('markdown')
     def generate_markdown_text(self, with_figures:bool = True) -> str:
         """ Generate the markdown summary
 
@@ -887,9 +1821,7 @@ class LatexDocument:
         latex_title = tex2md(self.title.replace('~', ' '))
         latex_authors = self.short_authors
         joined_latex_authors = ', '.join(latex_authors)
-        selected_latex_figures = self.select_arxivertag_figures()
-        if not selected_latex_figures:
-            selected_latex_figures = self.select_most_cited_figures()
+        selected_latex_figures = self.select_figures() if with_figures else []
         macros_md = self.get_macros_markdown_text() + '\n\n'
 
         text = f"""{macros_md}\n\n<div id="title">\n\n# {latex_title:s}\n\n</div>\n"""
@@ -1,12 +1,17 @@
-from glob import glob
+from collections import OrderedDict
 from itertools import chain
-from pybtex.database import parse_file
-from pybtex.database import BibliographyData, Entry
+from pybtex.database import parse_file, parse_string
+from pybtex.database import BibliographyData, Entry, Person
+from pybtex.bibtex.utils import split_name_list
+from pybtex.textutils import normalize_whitespace
+from pybtex.utils import OrderedCaseInsensitiveDict
 from typing import Union, Sequence
-import os
 import re
 import warnings
-from .latex import LatexDocument
+from .latex import LatexDocument, replace_special_characters
+from .bib_index import BibIndex, get_spans
+from .source_tree import SourceTree, as_source_tree
+from . import instrument
 
 def clean_special_characters(source: str) -> str:
     """ Replace latex macros of special characters (accents etc) for their unicode alternatives
@@ -14,150 +19,273 @@ def clean_special_characters(source: str) -> str:
     :param source: bibitem raw string definition
     :return: transformed bibitem string definition
     """
-    # special characters
-    which = [
-        (r'\\~{n}', r'ñ'),
-        (r'\\~{o}', r'õ'),
-        (r'\\~{a}', r'ã'),
-        (r"\\`{a}", r'à'),
-        (r"\\`{e}", r'è'),
-        (r"\\`{i}", r'ì'),
-        (r"\\`{o}", r'ò'),
-        (r"\\`{u}", r'ù'),
-        (r"\\'{a}", r'á'),
-        (r"\\'{e}", r'é'),
-        (r"\\'{i}", r'í'),
-        (r"\\'{o}", r'ó'),
-        (r"\\'{u}", r'ú'),
-        (r'\\"{u}', r'ü'),
-        (r'\\"{o}', r'ö'),
-        (r'\\"{a}', r'ä'),
-        (r'\\"{e}', r'ë'),
-        (r'\\"{i}', r'ï'),
-        (r'\\^{i}', r'î'),
-        (r'\\^{e}', r'ê'),
-        (r'\\c{c}', r'ç'),
-        (r"\\'{\\i}", r'í'),
-        (r"\\`{\\i}", r'ì'),
-        (r"\\AA", r'Å'),
-    ]
-
-    # add those without the {}
-    which = which + [(k.replace('{', '').replace('}', ''), v) for k, v in which]
-    # add capital letters too
-    which = which + [(k.upper(), v.upper()) for k, v in which]
-
-    for from_, to_ in which:
-        source = re.sub(from_, to_, source)
-    return source
-
-
-def parse_bbl(fname: str) -> BibliographyData:
-    """ Parse bibliographic information from bbl file (compiled bibliography)
+    return replace_special_characters(source, degree=False)
 
-    :param fname: filename to read the data from
-    :return: biblio data object
-    """
 
-    def extract_bibitem_info(item_str: str) -> dict:
-        """Get groups of info from bibitem definition
+# start of the bibitem entries
+_BIBITEM = re.compile(r'\\bibitem', re.IGNORECASE)
 
-        Thanks to https://regex101.com/
-        """
-        regex_href = r"""
+_BIBITEM_FLAGS = re.DOTALL | re.IGNORECASE | re.VERBOSE | re.MULTILINE
+
+# fields of a bibitem entry (thanks to https://regex101.com/)
+_BIBITEM_HREF = re.compile(r"""
         \\bibitem(\[[^\[\]]*?\]){(?P<bibkey>[a-zA-Z0-9\-\+\.\S]+?)}(?P<authors>|([\D]*?))(?P<year>[12][0-9]{3}).*?href(.*?{(?P<url>http[\S]*)})(?P<rest>.*)
-        """
-        regex_nohref = r"""
+        """, _BIBITEM_FLAGS)
+_BIBITEM_NOHREF = re.compile(r"""
         \\bibitem(\[[^\[\]]*?\]){(?P<bibkey>[a-zA-Z0-9\-\+\.\S]+?)}(?P<authors>|([\D]*?))(?P<year>[12][0-9]{3})(?P<rest>.*)
-        """
+        """, _BIBITEM_FLAGS)
 
-        # You can manually specify the number of replacements by changing the 4th argument
-        regex = regex_href if r'\href' in item_str else regex_nohref
+_BIBITEM_AUTHOR = re.compile(r"(?P<last>{[\w{}\~\-\\]+})[,\s]+?(?P<first>[\w{}\~\-\\\.\s]+),*")
 
-        # replace special characters
-        item_str = item_str.replace(r'\&', '')
-        item_str = clean_special_characters(item_str)
 
-        matches = re.search(regex, item_str.replace('\n', ' '),
-                            re.DOTALL | re.IGNORECASE | re.VERBOSE | re.MULTILINE)
+def split_bibitems(content: str) -> Sequence[str]:
+    """ Split the content of a bbl file into bibitem definitions (without line breaks)
 
-        try:
-            info = matches.groupdict()
-        except AttributeError as e:
-            raise RuntimeError(f"Error processing bibitem\n item = {item_str}\n regex = {regex}")
-        info.setdefault('title', "")
-        info.setdefault('url', "")
-        return info
-
-    def find_bibitem(sample: str) -> Sequence[str]:
-        """ Find bibitem definitions in a string"""
-        entries = re.findall(r'(\\bibitem)((.(?!bibitem))*)',
-                             sample, re.DOTALL | re.IGNORECASE | re.VERBOSE | re.MULTILINE)
-        entries = [''.join(entry).replace('\n', '').strip() for entry in entries]
-        return entries
-
-    def clean_author(authors):
-        """ Put things in the right format for bibtex """
-        regex = r"(?P<last>{[\w{}\~\-\\]+})[,\s]+?(?P<first>[\w{}\~\-\\\.\s]+),*"
-        return ['{0:s}, {1:s}'.format(*it)
-                for it in re.findall(regex, authors.strip())]
-
-    def get_bibtex_code(rk: dict):
-        tpl = """
-@article{{{bibkey:s},
-  title = "{title:s}",
-  author = {{{authors:s}}},
-  url = "{url:s}",
-  year = "{year:s}"
-}}
-"""
-        rk['authors'] = ' and '.join(clean_author(rk['authors']))
-        return tpl.format(**rk)
+    :param content: content of the bbl file
+    :return: the bibitem definitions
+    """
+    text = content.replace('\n', '')
+    starts = [match.start() for match in _BIBITEM.finditer(text)]
+    return [text[start:end].strip() for start, end in zip(starts, starts[1:] + [len(text)])]
+
+
+def extract_bibitem_info(item_str: str) -> dict:
+    """ Get the key, authors, year and url of a bibitem definition
+
+    :param item_str: bibitem definition (see :func:`split_bibitems`)
+    :return: dict(bibkey, authors, year, url, title, rest)
+    """
+    regex = _BIBITEM_HREF if r'\href' in item_str else _BIBITEM_NOHREF
+
+    # replace special characters
+    item_str = clean_special_characters(item_str.replace(r'\&', ''))
+
+    matches = regex.search(item_str)
+    if matches is None:
+        raise RuntimeError(f"Error processing bibitem\n item = {item_str}\n regex = {regex.pattern}")
+    info = matches.groupdict()
+    info.setdefault('title', "")
+    info.setdefault('url', "")
+    return info
+
+
+def bibitem_to_entry(info: dict) -> Entry:
+    """ Bibliographic entry from the fields of a bibitem (see :func:`extract_bibitem_info`)
+
+    The values are processed as pybtex does when parsing BibTeX (whitespace
+    normalization, split of the author names).
+
+    :param info: fields of the bibitem
+    :return: article entry with title, author, url and year
+    """
+    authors = ' and '.join('{0:s}, {1:s}'.format(*it)
+                           for it in _BIBITEM_AUTHOR.findall(info['authors'].strip()))
+    entry = Entry('article')
+    for field in ('title', 'url', 'year'):
+        entry.fields[field] = normalize_whitespace(info[field] or '')
+    for name in split_name_list(normalize_whitespace(authors)):
+        entry.add_person(Person(name), 'author')
+    return entry
+
+
+# citation commands: whether the citations are put in parentheses
+CITATION_KINDS = {'cite': False, 'citet': False, 'citep': True, 'citealt': True,
+                  'citealp': True, 'citeauthor': False, 'citeyear': False}
+
+# any \cite variant with optional starred form and [pre][post] notes
+_CITATION = re.compile(r"\\(cite[a-zA-Z]*)\*?((?:\[[^\]]*\]){0,2})\{([^}\n]*)\}")
+
+
+def get_cited_keys(text: str) -> Sequence[str]:
+    """ Keys cited in a text (e.g., the markdown summary) by the commands of
+    :data:`CITATION_KINDS`, i.e., the keys replaced by :func:`replace_citations`
+
+    :param text: text with citation commands
+    :return: unique keys in order of appearance
+    """
+    keys = {}
+    for match in _CITATION.finditer(text):
+        if match.group(1) not in CITATION_KINDS:
+            continue
+        for key in match.group(3).split(','):
+            key = key.strip()
+            if key:
+                keys.setdefault(key, None)
+    return list(keys)
+
+
+# index of the bibliography files shared by the lazy parsing (see `get_default_index`)
+_DEFAULT_INDEX = None
+
+
+def get_default_index() -> BibIndex:
+    """ Index of the bibliography files used in lazy mode when none is given
+
+    The index is created on first use and stored on disk (in the default
+    directory of :class:`arxiv_on_deck_2.bib_index.BibIndex`), so that the
+    key-offset indexes of the files are reused across calls and runs.
+
+    :return: the shared index
+    """
+    global _DEFAULT_INDEX
+    if _DEFAULT_INDEX is None:
+        _DEFAULT_INDEX = BibIndex()
+    return _DEFAULT_INDEX
+
+
+@instrument.timed('bbl parse')
+def parse_bbl(fname: str, tree: SourceTree = None, keys: Sequence[str] = None,
+              index: BibIndex = None) -> BibliographyData:
+    """ Parse bibliographic information from bbl file (compiled bibliography)
 
+    :param fname: filename to read the data from
+    :param tree: source tree containing the file (default on disk)
+    :param keys: only parse the entries of these keys (all if None)
+    :param index: index of the files in lazy mode (default :func:`get_default_index`)
+    :return: biblio data object
+    """
     # Read file
-    with open(fname, 'r') as fin:
-        content = fin.read()
+    content = as_source_tree(tree).read_text(fname)
 
     # identify entries
-    entries = find_bibitem(content)
-    n_entries = len(entries)
-    print(f"Found {n_entries:,d} bibliographic references in {fname:s}.")
+    if keys is None:
+        entries = split_bibitems(content)
+        n_entries = len(entries)
+        print(f"Found {n_entries:,d} bibliographic references in {fname:s}.")
+    else:
+        file_index = (index or get_default_index()).get(content, 'bbl')
+        entries = [content[start:end].replace('\n', '').strip()
+                   for start, end in get_spans(file_index, keys)]
+        n_entries = len(entries)
+        print(f"Found {len(file_index['entries']):,d} bibliographic references in {fname:s} "
+              f"({n_entries:,d} cited).")
+    instrument.add(nbytes=len(content), count=n_entries)
 
     # extract individual fields per entry
-    r = []
+    bib_data = BibliographyData()
     for it in entries:
         try:
-            r.append(extract_bibitem_info(it))
+            info = extract_bibitem_info(it)
         except RuntimeError as e:
             warnings.warn(str(e))
+            continue
+        bib_data.add_entry(info['bibkey'], bibitem_to_entry(info))
+    return bib_data
+
+
+@instrument.timed('bib parse')
+def parse_bib(fname: str, tree: SourceTree = None, keys: Sequence[str] = None,
+              index: BibIndex = None) -> BibliographyData:
+    """ Parse bibliographic information from a bib file
+
+    :param fname: filename to read the data from
+    :param tree: source tree containing the file (default on disk)
+    :param keys: only parse the entries of these keys (all if None)
+    :param index: index of the files in lazy mode (default :func:`get_default_index`)
+    :return: biblio data object
+    """
+    content = as_source_tree(tree).read_text(fname)
+    instrument.add(nbytes=len(content))
+    if keys is None:
+        return parse_string(content, 'bibtex')
+    file_index = (index or get_default_index()).get(content, 'bib')
+    # the @string definitions may be used by the entries
+    spans = file_index['strings'] + get_spans(file_index, keys)
+    return parse_string(''.join(content[start:end] for start, end in spans), 'bibtex')
 
-    # create the bibtex text
-    bibtex = ''.join(get_bibtex_code(rk) for rk in r)
-    return BibliographyData.from_string(bibtex, 'bibtex')
 
+# how to choose between entries with the same key when merging
+DUPLICATE_POLICIES = ('first', 'last', 'richest')
 
-def merge_BibliographyData(dbs: Sequence[BibliographyData]) -> BibliographyData:
+
+def _richness(entry: Entry) -> int:
+    """ number of fields and persons of an entry """
+    return len(entry.fields) + sum(len(persons) for persons in entry.persons.values())
+
+
+def merge_BibliographyData(dbs: Sequence[BibliographyData],
+                           duplicates: str = 'first') -> BibliographyData:
     """ Merge BibliographyData objects
 
+    Keys are case insensitive. When several objects define the same key, the
+    entry kept depends on `duplicates`:
+
+    * `first`: the first definition
+    * `last`: the last definition
+    * `richest`: the definition with the most fields and persons (first if equal)
+
+    Entries keep the position of the first definition of their key.
+
     :param dbs: Sequence of bibliographic data objects
+    :param duplicates: policy for duplicate keys (see :data:`DUPLICATE_POLICIES`)
     :return: single bibliographic data with all entries from dbs
     """
-    b = BibliographyData()
-    b = BibliographyData()
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError(f"expected duplicates in {DUPLICATE_POLICIES}. Got {duplicates}.")
+    merged = {}
     for bdata in dbs:
         for key, entry in bdata.entries.items():
-            b.add_entry(key, entry)
+            lower = key.lower()
+            current = merged.get(lower)
+            if (current is None) or (duplicates == 'last') or \
+                    (duplicates == 'richest' and _richness(entry) > _richness(current[1])):
+                merged[lower] = (key, entry)
+    b = BibliographyData()
+    b.entries = OrderedCaseInsensitiveDict(merged.values())
     return b
 
 
 class LatexBib:
-    """ A small interface to pybtex to handle bibliography entries """
-    def __init__(self, bibdata: BibliographyData):
+    """ A small interface to pybtex to handle bibliography entries
+
+    The formatted citations of the keys are memoised (up to `cache_size`
+    citations, the least recently used are evicted first); `hits` and
+    `misses` count the cache lookups.
+    """
+    def __init__(self, bibdata: BibliographyData, cache_size: int = 4096):
         """ Constructor
 
         :param bibdata: the bibliography object class from pybtex
+        :param cache_size: maximum number of memoised formatted citations
         """
         self.bibdata = bibdata
+        self.cache_size = cache_size
+        self._citations = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _memoised(self, fmt: str, key: Union[str, Entry], kind: str, max_authors: int,
+                  compute: callable) -> str:
+        """ Formatted citation from the cache, computed and stored if needed
+
+        Entries given as objects are not cached, nor missing keys (KeyError).
+        """
+        if not isinstance(key, str):
+            return compute()
+        cache_key = (fmt, key, kind, max_authors)
+        value = self._citations.get(cache_key)
+        if value is not None:
+            self.hits += 1
+            self._citations.move_to_end(cache_key)
+            return value
+        self.misses += 1
+        value = compute()
+        if len(self._citations) >= self.cache_size:
+            self._citations.popitem(last=False)
+        self._citations[cache_key] = value
+        return value
+
+    def cache_info(self) -> dict:
+        """ Statistics of the formatted citation cache
+
+        :return: dict(hits, misses, size, max_size)
+        """
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._citations), max_size=self.cache_size)
+
+    def clear_cache(self):
+        """ Forget the formatted citations (e.g., after changing `bibdata`) """
+        self._citations = OrderedDict()
 
     def _key_or_entry(self, key_or_entry: Union[str, Entry]) -> Entry:
         """ A check on argument type. Returns a corresponding entry
@@ -226,21 +354,33 @@ class LatexBib:
         examples:
         * `kind="citet"` -> author1, et al. (2023)
         * `kind="cite"` -> author1 and author2 2023
+        * `kind="citeauthor"` -> author1 and author2
+        * `kind="citeyear"` -> 2023
 
         :param key: key to extract from
-        :param kind: the kind of latex citation (expecting cite, citealt, citet, citep)
+        :param kind: the kind of latex citation (expecting cite, citealt, citealp, citet, citep,
+                     citeauthor, citeyear)
         :param max_authors: the number of authors to allow before "et. al" abbrv.
         :return: the formatted citation text
         """
+        return self._memoised('text', key, kind, max_authors,
+                              lambda: self._format_citation_text(key, kind, max_authors))
 
+    def _format_citation_text(self, key: Union[str, Entry], kind: str = 'cite',
+                              max_authors: int = 3) -> str:
+        """ Formatted text of a citation (see :meth:`get_citation_text`) """
         entry = self._key_or_entry(key)
 
+        if kind in ('citeyear', ):
+            return self.get_year(entry)
         authors = self.get_short_authors(entry, max_authors=max_authors)
+        if kind in ('citeauthor', ):
+            return authors
         year = self.get_year(entry)
 
         if kind in ('citep', ):
             citation_text = f"{authors} {year}"
-        elif kind in ('citealt', ):
+        elif kind in ('citealt', 'citealp'):
             citation_text = f"{authors} {year}"
         else:
             citation_text = f"{authors} ({year})"
@@ -256,92 +396,124 @@ class LatexBib:
         * `kind="cite"` -> [author1 and author2 2023](url)
 
         :param key: key to extract from
-        :param kind: the kind of latex citation (expecting cite, citealt, citet, citep)
+        :param kind: the kind of latex citation (expecting cite, citealt, citealp, citet, citep,
+                     citeauthor, citeyear)
         :param max_authors: the number of authors to allow before "et. al" abbrv.
         :return: the formatted citation text
         """
+        return self._memoised('md', key, kind, max_authors,
+                              lambda: self._format_citation_md(key, kind, max_authors))
+
+    def _format_citation_md(self, key: Union[str, Entry], kind: str = 'cite',
+                            max_authors: int = 3) -> str:
+        """ Formatted markdown of a citation (see :meth:`get_citation_md`) """
         entry = self._key_or_entry(key)
 
-        citation_text = self.get_citation_text(entry, kind, max_authors)
+        citation_text = self._format_citation_text(entry, kind, max_authors)
         url = self.get_url(entry)
         citation_md = f"[{citation_text}]({url})"
         return citation_md
 
+    def format_citations(self, keys: Sequence[str], kind: str = 'cite',
+                         max_authors: int = 3) -> Sequence[str]:
+        """ Formatted markdown strings of several citations
+
+        :param keys: keys to extract from
+        :param kind: the kind of latex citation (see :meth:`get_citation_md`)
+        :param max_authors: the number of authors to allow before "et. al" abbrv.
+        :return: the formatted citations in the order of the keys
+        :raises KeyError: if a key is not in the bibliography
+        """
+        return [self.get_citation_md(key, kind=kind, max_authors=max_authors) for key in keys]
+
     @classmethod
-    def from_doc(cls, doc: LatexDocument):
+    @instrument.timed('bibliography')
+    def from_doc(cls, doc: LatexDocument, keys: Sequence[str] = None,
+                 index: BibIndex = None, duplicates: str = 'first'):
         """Create from a LatexDocument object
 
         First check if there is any `.bbl` file with the document,
         if not attempts to read the `.bib` file instead.
 
+        In lazy mode, only the entries of the given keys are parsed, e.g.,
+        the keys cited in the summary (see :func:`get_cited_keys`)::
+
+            md = doc.generate_markdown_text()
+            bib = LatexBib.from_doc(doc, keys=get_cited_keys(md))
+
         :param doc: the document to link with
+        :param keys: only load the entries of these keys (all if None)
+        :param index: :class:`arxiv_on_deck_2.bib_index.BibIndex` of the files in lazy mode
+                      (default :func:`get_default_index`)
+        :param duplicates: policy for keys defined in several files
+                           (see :func:`merge_BibliographyData`)
         :return: LatexBib object
 
         TODO: extract bibitems entries from main doc if any
         """
-        bbl_files = glob(os.path.join(doc.folder, '*.bbl'))
+        tree = doc.tree
+        bbl_files = tree.glob('*.bbl')
         if bbl_files:
-            bib_data = [parse_bbl(fname) for fname in bbl_files]
+            bib_data = [parse_bbl(fname, tree=tree, keys=keys, index=index)
+                        for fname in bbl_files]
         else:
-            bibfiles = doc.content.find_all('bibliography')[0].text
-            bibfiles = list(*chain([glob(os.path.join(doc.folder, bk + '*')) for bk in bibfiles]))
-            bib_data = []
-            for bibfile in bibfiles:
-                with open(str(bibfile)) as bibtex_file:
-                    bib_database = parse_file(bibtex_file)
-                bib_data.append(bib_database)
-        bib_data = merge_BibliographyData(bib_data)
+            bibfiles = doc.get_bibliography_files()
+            bibfiles = list(chain.from_iterable(tree.glob(bk.strip() + '*')
+                                                for name in bibfiles for bk in name.split(',')))
+            bib_data = [parse_bib(str(bibfile), tree=tree, keys=keys, index=index)
+                        for bibfile in bibfiles]
+        bib_data = merge_BibliographyData(bib_data, duplicates=duplicates)
 
         return cls(bib_data)
 
 
 def replace_citations(full_md: str, bibdata: LatexBib, kind='all', raise_exceptions: bool = False):
-    """ Parse and replace \citex calls remaining in the Markdown text
+    r""" Parse and replace \citex calls remaining in the Markdown text
+
+    All citation commands are replaced in a single pass. Optional notes
+    (`\citep[see][p. 3]{key}`) are kept around the citations.
 
     :param full_md: Markdown document
     :param bibdata: the bibliographic data
-    :param kind: which of \citex macros (all, citet, citep, citealt)
+    :param kind: which of \citex macros (all or one of :data:`CITATION_KINDS`)
     :param raise_exceptions: set to block if a citation is raising issues
     :return: updated content
     """
-    allowed = ('all', 'citet', 'citep', 'citealt', 'cite')
+    allowed = ('all',) + tuple(CITATION_KINDS)
 
     if kind not in allowed:
         raise RuntimeError(f"expected kind in {allowed}. Got {kind}.")
 
-    if kind == 'all':
-        new_text = full_md[:]
-        for kind in ('citep', 'citet', 'cite', 'citealt'):
-            new_text = replace_citations(new_text, bibdata, kind=kind)
-        return new_text
-
-    new_text = ""
+    hits, misses = bibdata.hits, bibdata.misses
+    parts = []
     last_pos = 0
-
-    r = re.finditer(r"(\\" + kind + r"{)(.*?)\}", full_md)
-    for rk in r:
-        keys = rk.groups()[1].split(',')
-        try:
-            values = []
-            for key in keys:
-                try:
-                    values.append(bibdata.get_citation_md(key.strip(), kind=kind))
-                except KeyError as e:
-                    if raise_exceptions:
-                        raise(e)
-                    else:
-                        values.append(key)
-                        print(f"Error retrieving bib data for {key}: {e}") 
-            mdtext = ', '.join(values)
-            if kind in ('citep', 'citealt'):
-                mdtext = ' (' + mdtext + ') '
-            new_text = ''.join((new_text,
-                               full_md[last_pos: rk.start()],
-                               mdtext))
-        except KeyError as e:
-            if raise_exceptions:
-                raise(e)
+    for rk in _CITATION.finditer(full_md):
+        command, notes, keys = rk.groups()
+        if (command not in CITATION_KINDS) or (kind not in ('all', command)):
+            continue
+        values = []
+        for key in keys.split(','):
+            try:
+                values.append(bibdata.get_citation_md(key.strip(), kind=command))
+            except KeyError as e:
+                if raise_exceptions:
+                    raise(e)
+                else:
+                    values.append(key)
+                    print(f"Error retrieving bib data for {key}: {e}")
+        mdtext = ', '.join(values)
+        if notes:
+            notes = notes[1:-1].split('][')
+            if len(notes) > 1:
+                mdtext = ' '.join((notes[0], mdtext)) if notes[0] else mdtext
+            if notes[-1]:
+                mdtext = ', '.join((mdtext, notes[-1]))
+        if CITATION_KINDS[command]:
+            mdtext = ' (' + mdtext + ') '
+        parts.append(full_md[last_pos: rk.start()])
+        parts.append(mdtext)
         last_pos = rk.end()
-    new_text = ''.join((new_text,
-                        full_md[last_pos:]))
-    return new_text
+    parts.append(full_md[last_pos:])
+    instrument.add_count('citation cache hits', bibdata.hits - hits)
+    instrument.add_count('citation cache misses', bibdata.misses - misses)
+    return ''.join(parts)
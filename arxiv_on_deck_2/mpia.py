@@ -9,8 +9,10 @@ from typing import Sequence
 from bs4 import BeautifulSoup
 import requests
 import re
+from . import instrument
 
 
+@instrument.timed('staff scrape')
 def parse_mpia_staff_list() -> Sequence[str]:
     """ Parse the multi-page table from the MPIA website and returns the name column
     :returns: list of names (full names)
@@ -21,11 +23,13 @@ def parse_mpia_staff_list() -> Sequence[str]:
         # print(f'parsing page {pagenum}')
         response = requests.get(mitarbeiter_url.format(pagenum=pagenum))
         response.raise_for_status()
+        instrument.add(nbytes=len(response.content))
         soup = BeautifulSoup(response.content, 'html.parser')
         lst = soup.find_all('span', attrs={'class': 'employee_name'})
         if not lst:
             break
         data.extend([k.text for k in lst])
+    instrument.add(count=len(data))
     return data
 
 
@@ -160,3 +164,21 @@ def affiliation_verifications(content: str,
                 return ("'{0:s}' keyword not found.".format(word))
             return False
     return check
+
+
+class AffiliationError(RuntimeError):
+    pass
+
+
+def validation(source: str):
+    """ Raises error paper during parsing of source file
+
+    Allows checks before parsing TeX code
+    (see :func:`arxiv_on_deck_2.latex.LatexDocument`).
+
+    :param source: TeX source of the paper
+    :raises AffiliationError: if the affiliation keywords are not found
+    """
+    check = affiliation_verifications(source, verbose=True)
+    if check is not True:
+        raise AffiliationError("mpia.affiliation_verifications: " + check)
@@ -0,0 +1,93 @@
+""" On-disk cache of the structure extracted from parsed LaTeX documents
+
+Parsing the cleaned source with TexSoup is the most expensive step of the
+processing of a paper. The cache stores what
+:class:`arxiv_on_deck_2.latex.LatexDocument` extracts from the parsed
+document (title, authors, abstract, figures, macros, graphicspath,
+bibliography files) as JSON, keyed by the hash of the cleaned source, the
+parser version and the extraction version. A document built from a cached
+source does not call TexSoup at all.
+
+Layout of the cache directory::
+
+    ab/abcd....json     extracted structure
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Union
+import TexSoup
+
+
+# increase when the extracted structure changes
+EXTRACTION_VERSION = 2
+
+PARSER_VERSION = f"TexSoup-{getattr(TexSoup, '__version__', 'unknown')}/{EXTRACTION_VERSION}"
+
+
+class ParseCache:
+    """ On-disk cache of extracted document structures
+
+    :param directory: where to store the cache
+    :param parser_version: version string included in the keys
+    """
+    def __init__(self, directory: str = "tmp_parse_cache",
+                 parser_version: str = PARSER_VERSION):
+        self.directory = directory
+        self.parser_version = parser_version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source: str, variant: str = '') -> str:
+        """ Key of a cleaned source
+
+        :param source: cleaned source of the document
+        :param variant: extraction variant (e.g. the parsing engine)
+        :return: hexadecimal digest
+        """
+        digest = hashlib.sha256(f"{self.parser_version}:{variant}".encode())
+        digest.update(source.encode('utf-8', errors='surrogateescape'))
+        return digest.hexdigest()
+
+    def _file(self, key: str) -> str:
+        """ filename of an entry """
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def __contains__(self, source: str) -> bool:
+        return os.path.exists(self._file(self.key(source)))
+
+    def get(self, source: str, variant: str = '') -> Union[dict, None]:
+        """ Structure extracted from a source if stored
+
+        :param source: cleaned source of the document
+        :param variant: extraction variant (e.g. the parsing engine)
+        :return: the structure or None
+        """
+        try:
+            with open(self._file(self.key(source, variant)), 'r') as fin:
+                data = json.load(fin)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, source: str, data: dict, variant: str = '') -> str:
+        """ Store the structure extracted from a source
+
+        :param source: cleaned source of the document
+        :param data: the structure (JSON serializable)
+        :param variant: extraction variant (e.g. the parsing engine)
+        :return: the key of the entry
+        """
+        key = self.key(source, variant)
+        fname = self._file(key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        tmpfile = fname + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmpfile, 'w') as fout:
+            json.dump(data, fout)
+        os.replace(tmpfile, fname)
+        return key
@@ -0,0 +1,250 @@
+""" Parallel processing of the candidate papers
+
+Each paper is processed in its own worker process (download, LaTeX parsing,
+author highlighting and markdown generation), at most `workers` at a time.
+A paper that raises, crashes its process or exceeds its budget (wall-clock
+time, resident memory) is recorded as a failure without affecting the
+others. Workers report the stage they are in (`source`, `figures`,
+`markdown`) so that failures indicate where a paper got stuck.
+
+The results follow the daily digest conventions:
+
+- documents: list of `(paper_id, markdown)`
+- failed: list of `(paper, reason)`
+"""
+
+import multiprocessing
+import os
+import time
+import warnings
+from multiprocessing.connection import wait
+from typing import Sequence, Tuple, Union
+from .arxiv2 import ArxivPaper, get_markdown_badge, retrieve_document_sources
+from .arxiv_vanity import AuthorMatcher
+from .latex import LatexDocument, LatexWarning
+from .mpia import AffiliationError
+from . import instrument
+
+
+def get_paper_id(paper: ArxivPaper) -> str:
+    """ Arxiv identifier of a paper without the `arxiv:` prefix
+
+    :param paper: the paper object
+    :return: identifier
+    """
+    return paper['identifier'].lower().replace('arxiv:', '')
+
+
+def process_paper(paper: ArxivPaper, folder: str,
+                  hl_list: Union[Sequence[str], AuthorMatcher] = None,
+                  validation: callable = None,
+                  on_stage: callable = None,
+                  parse_cache=None,
+                  engine: str = 'texsoup',
+                  figure_cache=None,
+                  figure_options: dict = None) -> str:
+    """ Generate the markdown summary of a paper from its source
+
+    :param paper: the paper object (from the listing)
+    :param folder: folder (or source tree) containing the paper source
+    :param hl_list: the list of authors to highlight (or an :class:`AuthorMatcher`)
+    :param validation: check of the source before parsing (see :class:`LatexDocument`)
+    :param on_stage: called with the name of each stage when it starts
+    :param parse_cache: optional :class:`arxiv_on_deck_2.parse_cache.ParseCache`
+    :param engine: parsing engine of :class:`arxiv_on_deck_2.latex.LatexDocument`
+    :param figure_cache: optional :class:`arxiv_on_deck_2.figure_cache.FigureCache`
+    :param figure_options: conversion options of the figures (see :class:`LatexDocument`)
+    :return: markdown text
+    """
+    if on_stage is None:
+        on_stage = lambda stage: None
+    paper_id = get_paper_id(paper)
+    on_stage('source')
+    doc = LatexDocument(folder, validation=validation, parse_cache=parse_cache, engine=engine,
+                        figure_cache=figure_cache, figure_options=figure_options)
+
+    # Hack because sometimes author parsing does not work well
+    if (len(doc.authors) != len(paper['authors'])):
+        doc._authors = paper['authors']
+    if (doc.abstract) in (None, ''):
+        doc._abstract = paper['abstract']
+
+    doc.comment = get_markdown_badge(paper_id) + " _" + paper['comments'] + "_"
+    if hl_list is not None:
+        doc.highlight_authors_in_list(hl_list)
+
+    # only the selected figures are converted
+    on_stage('figures')
+    doc.select_figures()
+    on_stage('markdown')
+    return doc.generate_markdown_text()
+
+
+def _run_paper(conn, stage, paper: ArxivPaper, folder: str, options: dict,
+               affiliation_errors: tuple):
+    """ Worker process: process one paper and send back (status, result)
+
+    The current stage is written into the shared `stage` buffer.
+    """
+    def on_stage(name: str):
+        stage.value = name.encode()
+
+    # only send back the timings of this paper
+    instrument.reset()
+    try:
+        with instrument.paper_context(get_paper_id(paper)):
+            status, result = 'ok', process_paper(paper, folder, on_stage=on_stage, **options)
+    except affiliation_errors as affilerror:
+        status, result = 'failed', "affiliation error: " + str(affilerror)
+    except Exception as e:
+        status, result = 'failed', "latex error " + str(e)
+    try:
+        conn.send((status, result, instrument.get_records()))
+    finally:
+        conn.close()
+
+
+def _get_rss(pid: int) -> Union[int, None]:
+    """ Resident memory in bytes of a process (None if not available) """
+    try:
+        with open(f'/proc/{pid:d}/statm') as fin:
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _get_context():
+    """ Multiprocessing context (fork when available so that notebook functions can be used) """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def process_papers(candidates: Sequence[ArxivPaper],
+                   hl_list: Union[Sequence[str], AuthorMatcher] = None,
+                   validation: callable = None,
+                   workers: int = None,
+                   timeout: float = None,
+                   max_rss: int = None,
+                   directory: str = "tmp_{identifier}",
+                   cache=None,
+                   selective: bool = False,
+                   parse_cache=None,
+                   engine: str = 'texsoup',
+                   figure_cache=None,
+                   figure_options: dict = None,
+                   affiliation_errors: tuple = (AffiliationError,)
+                   ) -> Tuple[Sequence[Tuple[str, str]], Sequence[Tuple[ArxivPaper, str]]]:
+    """ Process candidate papers in parallel worker processes
+
+    Sources not yet in `directory` are first downloaded concurrently
+    (see :func:`arxiv_on_deck_2.arxiv2.retrieve_document_sources`).
+    Each paper is then processed by :func:`process_paper` in its own process.
+
+    :param candidates: the papers to process
+    :param hl_list: the list of authors to highlight (or an :class:`AuthorMatcher`)
+    :param validation: check of the source before parsing (e.g., :func:`arxiv_on_deck_2.mpia.validation`)
+    :param workers: number of concurrent processes (default number of CPUs)
+    :param timeout: maximum time in seconds per paper (None for no limit)
+    :param max_rss: maximum resident memory in bytes of a worker process
+                    (None for no limit, requires `/proc`, i.e. Linux)
+    :param directory: where the sources are, `{identifier}` is replaced by the paper identifier
+    :param cache: optional :class:`arxiv_on_deck_2.source_cache.SourceCache` for the downloads
+    :param selective: set to extract only the TeX files and referenced files
+    :param parse_cache: optional :class:`arxiv_on_deck_2.parse_cache.ParseCache`
+                        shared by the workers
+    :param engine: parsing engine of :class:`arxiv_on_deck_2.latex.LatexDocument`
+    :param figure_cache: optional :class:`arxiv_on_deck_2.figure_cache.FigureCache`
+                         shared by the workers
+    :param figure_options: conversion options of the figures (see :class:`LatexDocument`)
+    :param affiliation_errors: exception types reported as affiliation errors
+    :return: documents [(paper_id, markdown)], and failed [(paper, reason)]
+    """
+    workers = workers or os.cpu_count() or 1
+    if isinstance(hl_list, (list, tuple)):
+        hl_list = AuthorMatcher(hl_list)
+
+    folders = {}
+    errors = {}
+    for paper in candidates:
+        paper_id = get_paper_id(paper)
+        folders[paper_id] = directory.format(identifier=paper_id.replace('/', '_'))
+    missing = [paper_id for paper_id, folder in folders.items() if not os.path.isdir(folder)]
+    if missing:
+        report = retrieve_document_sources(missing, directory=directory, cache=cache,
+                                           selective=selective)
+        errors.update(report['failed'])
+
+    options = dict(hl_list=hl_list, validation=validation, parse_cache=parse_cache,
+                   engine=engine, figure_cache=figure_cache,
+                   figure_options=figure_options)
+    context = _get_context()
+    results = {}
+    pending = [(num, paper) for num, paper in enumerate(candidates)]
+    running = {}
+
+    def record(num: int, status: str, result: str):
+        """ store the result of a paper """
+        paper = candidates[num]
+        if status != 'ok':
+            if not result.startswith('affiliation'):
+                warnings.warn(LatexWarning(f"{get_paper_id(paper):s} did not run properly\n" +
+                                           result))
+        results[num] = (status, result)
+
+    while pending or running:
+        while pending and (len(running) < workers):
+            num, paper = pending.pop(0)
+            paper_id = get_paper_id(paper)
+            if paper_id in errors:
+                record(num, 'failed', "latex error " + errors[paper_id])
+                continue
+            receiver, sender = context.Pipe(duplex=False)
+            stage = context.Array('c', 32, lock=False)
+            proc = context.Process(target=_run_paper,
+                                   args=(sender, stage, paper, folders[paper_id], options,
+                                         affiliation_errors),
+                                   daemon=True)
+            proc.start()
+            sender.close()
+            running[receiver] = (num, proc, stage, time.monotonic())
+
+        for receiver in wait(list(running), timeout=0.1):
+            num, proc, stage, _ = running.pop(receiver)
+            try:
+                status, result, records = receiver.recv()
+                instrument.add_records(records)
+            except EOFError:
+                proc.join()
+                status, result = 'failed', (f"latex error process crashed (exit code {proc.exitcode}, "
+                                            f"stage: {stage.value.decode()})")
+            receiver.close()
+            proc.join()
+            record(num, status, result)
+
+        # enforce the budget: kill offending workers
+        now = time.monotonic()
+        for receiver, (num, proc, stage, start) in list(running.items()):
+            reason = None
+            if (timeout is not None) and (now - start > timeout):
+                reason = f"timeout after {timeout:g} s"
+            elif max_rss is not None:
+                rss = _get_rss(proc.pid)
+                if (rss is not None) and (rss > max_rss):
+                    reason = f"memory limit exceeded ({rss / 1024 ** 2:,.0f} MB)"
+            if reason is not None:
+                proc.kill()
+                proc.join()
+                running.pop(receiver)
+                receiver.close()
+                record(num, 'failed', f"latex error {reason} (stage: {stage.value.decode()})")
+
+    documents = []
+    failed = []
+    for num, paper in enumerate(candidates):
+        status, result = results[num]
+        if status == 'ok':
+            documents.append((get_paper_id(paper), result))
+        else:
+            failed.append((paper, result))
+    return documents, failed
@@ -0,0 +1,251 @@
+""" On-disk cache of the ArXiv e-print sources
+
+The raw e-prints (tarballs or gzipped single files) are stored once, named
+after the hash of their content, and indexed by ArXiv identifier (incl.
+version if given) in a JSON index file. The cache is bounded in size and
+evicts the least recently used sources first. Sources are only extracted
+when requested.
+
+Note that an identifier without version refers to the version retrieved at
+the time it was stored.
+
+Layout of the cache directory::
+
+    index.json          identifier -> (sha256, size, last access)
+    objects/ab/abcd...  raw e-print content
+    extracted/abcd...   extracted content (on demand)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from io import BytesIO
+from typing import Sequence
+import requests
+from .arxiv2 import EPRINT_URL, extract_source
+
+
+class SourceCache:
+    """ Content-addressed on-disk cache of e-print sources
+
+    :param directory: where to store the cache
+    :param max_size: maximum size in bytes of the stored raw sources
+    :param url: source url template, `{identifier}` is replaced by the paper identifier
+    :param session: HTTP session to use for downloads
+    :param timeout: timeout in seconds of each request
+    """
+    def __init__(self, directory: str = "tmp_sources_cache",
+                 max_size: int = 2 * 1024 ** 3,
+                 url: str = EPRINT_URL,
+                 session: requests.Session = None,
+                 timeout: float = 60.):
+        self.directory = directory
+        self.max_size = max_size
+        self.url = url
+        self.session = session
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'extracted'), exist_ok=True)
+        self.index = self._read_index()
+
+    @property
+    def index_file(self) -> str:
+        """ filename of the index """
+        return os.path.join(self.directory, 'index.json')
+
+    def _read_index(self) -> dict:
+        """ Read the index file if it exists """
+        try:
+            with open(self.index_file, 'r') as fin:
+                return json.load(fin)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self):
+        """ Atomically replace the index file """
+        tmpfile = self.index_file + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmpfile, 'w') as fout:
+            json.dump(self.index, fout, indent=1, sort_keys=True)
+        os.replace(tmpfile, self.index_file)
+
+    @staticmethod
+    def key(identifier: str) -> str:
+        """ Normalized identifier used as key in the index
+
+        :param identifier: Paper identification number from Arxiv (e.g. arXiv:2103.01970v2)
+        :return: key (e.g. 2103.01970v2)
+        """
+        return identifier.lower().replace('arxiv:', '').strip()
+
+    def _object_file(self, sha256: str) -> str:
+        """ filename of the raw content """
+        return os.path.join(self.directory, 'objects', sha256[:2], sha256)
+
+    def _extracted_dir(self, sha256: str) -> str:
+        """ directory of the extracted content """
+        return os.path.join(self.directory, 'extracted', sha256)
+
+    def __contains__(self, identifier: str) -> bool:
+        with self._lock:
+            entry = self.index.get(self.key(identifier))
+        return (entry is not None) and os.path.exists(self._object_file(entry['sha256']))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def size(self) -> int:
+        """ Total size in bytes of the stored raw sources """
+        with self._lock:
+            stored = {entry['sha256']: entry['size'] for entry in self.index.values()}
+        return sum(stored.values())
+
+    def put(self, identifier: str, content: bytes) -> str:
+        """ Store the raw e-print content of a paper
+
+        :param identifier: Paper identification number from Arxiv
+        :param content: raw e-print content
+        :return: the hash of the content
+        """
+        sha256 = hashlib.sha256(content).hexdigest()
+        fname = self._object_file(sha256)
+        if not os.path.exists(fname):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            tmpfile = fname + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmpfile, 'wb') as fout:
+                fout.write(content)
+            os.replace(tmpfile, fname)
+        with self._lock:
+            self.index[self.key(identifier)] = dict(sha256=sha256,
+                                                    size=len(content),
+                                                    last_access=time.time())
+            self.evict(keep=self.key(identifier))
+            self._write_index()
+        return sha256
+
+    def _download(self, identifier: str) -> bytes:
+        """ Retrieve the raw e-print from the network """
+        where = self.url.format(identifier=self.key(identifier))
+        print("Retrieving document from ", where)
+        getter = self.session if self.session is not None else requests
+        response = getter.get(where, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def _touch(self, identifier: str) -> dict:
+        """ Update the access time of an entry and return it """
+        with self._lock:
+            entry = self.index[self.key(identifier)]
+            entry['last_access'] = time.time()
+            self._write_index()
+            return dict(entry)
+
+    def get_raw(self, identifier: str) -> bytes:
+        """ Raw e-print content of a paper (downloaded only if not stored)
+
+        :param identifier: Paper identification number from Arxiv
+        :return: raw e-print content
+        """
+        if identifier in self:
+            entry = self._touch(identifier)
+            with open(self._object_file(entry['sha256']), 'rb') as fin:
+                return fin.read()
+        content = self._download(identifier)
+        self.put(identifier, content)
+        return content
+
+    def get_source(self, identifier: str, directory: str = None,
+                   selective: bool = False) -> str:
+        """ Directory with the extracted source of a paper
+
+        The source is downloaded if not stored, and extracted only if not
+        already available.
+
+        :param identifier: Paper identification number from Arxiv
+        :param directory: where to extract the files (default inside the cache).
+                          An existing directory is replaced.
+        :param selective: set to extract only the TeX files and referenced files
+        :return: directory in which the data was extracted
+        """
+        if (directory is None) and (identifier in self):
+            sha256 = self._touch(identifier)['sha256']
+            where = self._extracted_dir(sha256) + ('.selective' if selective else '')
+            if os.path.isdir(where):
+                return where
+
+        content = self.get_raw(identifier)
+        if directory is not None:
+            return extract_source(BytesIO(content), directory, selective=selective)
+
+        with self._lock:
+            sha256 = self.index[self.key(identifier)]['sha256']
+        where = self._extracted_dir(sha256) + ('.selective' if selective else '')
+        if not os.path.isdir(where):
+            # extract aside and rename: an existing directory is always complete
+            tmpdir = where + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            extract_source(BytesIO(content), tmpdir, selective=selective)
+            try:
+                os.rename(tmpdir, where)
+            except OSError:
+                # concurrently extracted by someone else
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        return where
+
+    def evict(self, max_size: int = None, keep: str = None) -> Sequence[str]:
+        """ Remove the least recently used sources until the cache fits in `max_size`
+
+        :param max_size: maximum size in bytes (default `self.max_size`)
+        :param keep: key of an entry to never evict
+        :return: list of evicted identifiers
+        """
+        if max_size is None:
+            max_size = self.max_size
+        evicted = []
+        with self._lock:
+            # contents are stored once: count the entries referring to each
+            refcounts = Counter(entry['sha256'] for entry in self.index.values())
+            stored = {entry['sha256']: entry['size'] for entry in self.index.values()}
+            total = sum(stored.values())
+            by_access = sorted(self.index.items(), key=lambda x: x[1]['last_access'])
+            for key, entry in by_access:
+                if total <= max_size:
+                    break
+                if key == keep:
+                    continue
+                del self.index[key]
+                evicted.append(key)
+                sha256 = entry['sha256']
+                refcounts[sha256] -= 1
+                # remove the content if no other entry refers to it
+                if refcounts[sha256] == 0:
+                    total -= stored[sha256]
+                    try:
+                        os.remove(self._object_file(sha256))
+                    except FileNotFoundError:
+                        pass
+                    shutil.rmtree(self._extracted_dir(sha256), ignore_errors=True)
+                    shutil.rmtree(self._extracted_dir(sha256) + '.selective',
+                                  ignore_errors=True)
+            if evicted:
+                self._write_index()
+        return evicted
+
+
+def get_source(identifier: str, cache: SourceCache = None, directory: str = None,
+               selective: bool = False) -> str:
+    """ Directory with the extracted source of a paper using a source cache
+
+    :param identifier: Paper identification number from Arxiv
+    :param cache: the cache to use (default cache if not provided)
+    :param directory: where to extract the files (default inside the cache)
+    :param selective: set to extract only the TeX files and referenced files
+    :return: directory in which the data was extracted
+    """
+    if cache is None:
+        cache = SourceCache()
+    return cache.get_source(identifier, directory=directory, selective=selective)
@@ -0,0 +1,239 @@
+""" Abstract source trees of LaTeX documents
+
+A document source is either a folder on disk or an in-memory mapping of
+file names to their content (e.g., built directly from an e-print stream).
+Both expose the same small interface used by the parsing code
+(:class:`arxiv_on_deck_2.latex.LatexDocument`,
+:class:`arxiv_on_deck_2.latex_bib.LatexBib`), so that a paper can be
+processed without extracting it to disk.
+
+Paths given to and returned by a tree are the tree's own paths: real paths
+(folder joined with the relative name) for :class:`FolderTree`, normalized
+relative names for :class:`MemoryTree`.
+"""
+
+import abc
+import fnmatch
+import hashlib
+import os
+import pathlib
+import posixpath
+from glob import glob
+from io import BytesIO
+from typing import Mapping, Sequence, Union
+
+
+class SourceTree(abc.ABC):
+    """ Interface of a document source tree """
+
+    root = ''
+
+    @abc.abstractmethod
+    def join(self, *parts: str) -> str:
+        """ Path of a file relative to the root of the tree """
+
+    @abc.abstractmethod
+    def glob(self, pattern: str) -> Sequence[str]:
+        """ Paths matching a glob pattern relative to the root (`**` matches any depth) """
+
+    @abc.abstractmethod
+    def exists(self, path: str) -> bool:
+        """ Check if a file exists in the tree """
+
+    @abc.abstractmethod
+    def read_bytes(self, path: str) -> bytes:
+        """ Content of a file """
+
+    @abc.abstractmethod
+    def write_bytes(self, path: str, data: bytes):
+        """ Store a new file in the tree """
+
+    def local_path(self, path: str) -> Union[str, None]:
+        """ Path on disk of a file if any (None for in-memory files) """
+        return None
+
+    def open(self, path: str):
+        """ Binary file object to read a file (e.g. to read only its head) """
+        return BytesIO(self.read_bytes(path))
+
+    def fingerprint(self, paths: Sequence[str]) -> str:
+        """ Hash identifying the current state of files of the tree
+
+        :param paths: files to include
+        :return: hexadecimal digest
+        """
+        digest = hashlib.sha1()
+        for path in sorted(paths):
+            digest.update(self.relative_path(path).encode('utf-8', errors='surrogateescape'))
+            digest.update(hashlib.sha1(self.read_bytes(path)).digest())
+        return digest.hexdigest()
+
+    def relative_path(self, path: str) -> str:
+        """ Normalized path of a file relative to the root of the tree """
+        if self.root:
+            path = os.path.relpath(path, self.root)
+        return posixpath.normpath(str(path).replace(os.sep, '/'))
+
+    def read_text(self, path: str, errors: str = 'strict') -> str:
+        """ Text content of a file """
+        return self.read_bytes(path).decode('utf-8', errors=errors)
+
+    def save_image(self, image, path: str, format: str, **kwargs):
+        """ Save a PIL image into the tree
+
+        :param image: PIL image
+        :param path: destination path
+        :param format: image format (e.g., PNG)
+        """
+        buffer = BytesIO()
+        image.save(buffer, format, **kwargs)
+        self.write_bytes(path, buffer.getvalue())
+
+
+class FolderTree(SourceTree):
+    """ Source tree of a folder on disk
+
+    :param folder: folder containing the document
+    """
+    def __init__(self, folder: str = ''):
+        self.root = folder
+
+    def join(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    def glob(self, pattern: str) -> Sequence[str]:
+        if '**' in pattern:
+            return [str(k) for k in pathlib.Path(f"{self.root}").glob(pattern)]
+        return glob(os.path.join(self.root, pattern))
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def read_bytes(self, path: str) -> bytes:
+        with open(path, 'rb') as fin:
+            return fin.read()
+
+    def read_text(self, path: str, errors: str = 'strict') -> str:
+        with open(path, 'r', errors=errors) as fin:
+            return fin.read()
+
+    def write_bytes(self, path: str, data: bytes):
+        with open(path, 'wb') as fout:
+            fout.write(data)
+
+    def local_path(self, path: str) -> str:
+        return path
+
+    def open(self, path: str):
+        return open(path, 'rb')
+
+    def fingerprint(self, paths: Sequence[str]) -> str:
+        """ Hash of the names, sizes and modification times of files (contents are not read) """
+        digest = hashlib.sha1()
+        for path in sorted(paths):
+            stat = os.stat(path)
+            digest.update(self.relative_path(path).encode('utf-8', errors='surrogateescape'))
+            digest.update(f":{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return digest.hexdigest()
+
+    def save_image(self, image, path: str, format: str, **kwargs):
+        image.save(path, format, **kwargs)
+
+    def __repr__(self):
+        return f"FolderTree({self.root!r})"
+
+
+def _normpath(path: str) -> str:
+    """ normalized relative path in a memory tree """
+    path = posixpath.normpath(str(path).replace('\\', '/'))
+    return '' if path == '.' else path.lstrip('/')
+
+
+def _match_parts(parts: Sequence[str], pattern: Sequence[str]) -> bool:
+    """ Match path components against glob components (`**` matches any depth) """
+    if not pattern:
+        return not parts
+    if pattern[0] == '**':
+        return any(_match_parts(parts[k:], pattern[1:]) for k in range(len(parts) + 1))
+    return (bool(parts) and fnmatch.fnmatchcase(parts[0], pattern[0])
+            and _match_parts(parts[1:], pattern[1:]))
+
+
+class MemoryTree(SourceTree):
+    """ In-memory source tree
+
+    :param files: mapping of file names to their content (bytes or str)
+    """
+    def __init__(self, files: Mapping[str, Union[bytes, str]] = None):
+        self.files = {}
+        for name, data in (files or {}).items():
+            self.write_bytes(name, data)
+
+    @classmethod
+    def from_eprint(cls, fileobj, **kwargs) -> 'MemoryTree':
+        """ Create the tree from an e-print stream
+
+        :param fileobj: file-like object of the e-print (gzipped tarball or gzipped single file)
+        :param kwargs: options of :func:`arxiv_on_deck_2.arxiv2.read_source_members`
+                       (by default only TeX and referenced files are kept)
+        :return: the tree object
+        """
+        from .arxiv2 import read_source_members
+        return cls(read_source_members(fileobj, **kwargs))
+
+    def join(self, *parts: str) -> str:
+        return _normpath(posixpath.join(*parts))
+
+    def glob(self, pattern: str) -> Sequence[str]:
+        pattern = _normpath(pattern).split('/')
+        return [name for name in self.files if _match_parts(name.split('/'), pattern)]
+
+    def exists(self, path: str) -> bool:
+        return _normpath(path) in self.files
+
+    def read_bytes(self, path: str) -> bytes:
+        try:
+            return self.files[_normpath(path)]
+        except KeyError:
+            raise FileNotFoundError(f"No such file in memory tree: '{path}'")
+
+    def write_bytes(self, path: str, data: Union[bytes, str]):
+        if isinstance(data, str):
+            data = data.encode('utf-8', errors='surrogateescape')
+        self.files[_normpath(path)] = data
+
+    def dump(self, directory: str, paths: Sequence[str] = None) -> str:
+        """ Write files of the tree to disk (e.g., figures to export)
+
+        :param directory: where to write the files
+        :param paths: files to write (all by default)
+        :return: the directory
+        """
+        for name in (self.files if paths is None else map(_normpath, paths)):
+            where = os.path.join(directory, name)
+            os.makedirs(os.path.dirname(where) or '.', exist_ok=True)
+            with open(where, 'wb') as fout:
+                fout.write(self.files[name])
+        return directory
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __repr__(self):
+        return f"MemoryTree({len(self.files):,d} files)"
+
+
+def as_source_tree(source: Union[str, Mapping[str, bytes], SourceTree, None]) -> SourceTree:
+    """ Get a source tree from a folder name, a mapping of files or a tree
+
+    :param source: folder name, mapping of file names to content, or tree
+                   (None for paths on disk)
+    :return: the source tree
+    """
+    if source is None:
+        return FolderTree()
+    if isinstance(source, SourceTree):
+        return source
+    if isinstance(source, Mapping):
+        return MemoryTree(source)
+    return FolderTree(str(source))
@@ -0,0 +1,205 @@
+""" Frozen corpus of synthetic, anonymised LaTeX source trees for the benchmarks
+
+The trees reproduce the structures that matter for the processing costs
+(large collaboration author lists, many figures, `.bbl`-only and
+`.bib`-only bibliographies, multi-file `\\input` trees, long texts with
+accents) with generated names and text. The generation is deterministic,
+so that the corpus is identical between runs and machines.
+
+Each tree is a mapping of file names to content that can be given directly
+to :class:`arxiv_on_deck_2.latex.LatexDocument` or written to disk with
+:func:`write_corpus`.
+"""
+
+import os
+import random
+import zlib
+from typing import Dict
+
+
+AFFILIATION = r"Max Planck Institute for Astronomy, K\"{o}nigstuhl 17, 69117 Heidelberg, Germany"
+
+WORDS = ("star galaxy cluster disk dust gas metallicity spectrum photometry "
+         "survey model distribution velocity mass luminosity redshift emission "
+         "absorption population formation evolution halo stream binary planet "
+         "orbit catalog sample parameter uncertainty analysis").split()
+
+ACCENTS = [r"\'{e}", r'\"{o}', r"\`{a}", r'\~{n}', r'\c{c}', r'\"{u}', r"\^{i}", r'\AA']
+
+
+def _png(rng: random.Random) -> bytes:
+    """ Small valid PNG image (8x8 pixels) """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (len(data).to_bytes(4, 'big') + kind + data +
+                zlib.crc32(kind + data).to_bytes(4, 'big'))
+    header = (8).to_bytes(4, 'big') * 2 + bytes([8, 2, 0, 0, 0])
+    raw = b''.join(b'\x00' + bytes(rng.randrange(256) for _ in range(24)) for _ in range(8))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def _name(rng: random.Random) -> str:
+    """ Generated author name """
+    first = ''.join(rng.choice('bcdfghklmnprstvz') + rng.choice('aeiou') for _ in range(2)).title()
+    last = ''.join(rng.choice('bcdfghklmnprstvz') + rng.choice('aeiou') for _ in range(3)).title()
+    return f"{first} {last}"
+
+
+def _sentence(rng: random.Random, refs: list = None, labels: list = None) -> str:
+    """ Generated sentence with math, accents, citations and references """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), f"$M_\\star = {rng.random():.2f}$")
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), f"Ca{rng.choice(ACCENTS)}ro")
+    if refs and rng.random() < 0.4:
+        words.append(_citation(rng, refs))
+    if labels and rng.random() < 0.3:
+        words.append(r'(Fig.~\ref{' + rng.choice(labels) + '})')
+    return ' '.join(words).capitalize() + '. % ' + rng.choice(WORDS) + '\n'
+
+
+def _citation(rng: random.Random, refs: list) -> str:
+    """ Generated citation command with optional notes """
+    keys = ', '.join(rng.sample(refs, min(len(refs), rng.randint(1, 3))))
+    command = rng.choice([r'\citep', r'\citet', r'\cite', r'\citealt'])
+    notes = rng.choice(['', '', '[sec. 2]', '[see][]', '[e.g.][p. 3]'])
+    return command + notes + '{' + keys + '}'
+
+
+def _section(rng: random.Random, title: str, nparagraphs: int, **kwargs) -> str:
+    """ Generated section """
+    text = [f"\\section{{{title}}}\n"]
+    for _ in range(nparagraphs):
+        text.append(''.join(_sentence(rng, **kwargs) for _ in range(rng.randint(3, 8))) + '\n')
+    return ''.join(text)
+
+
+def _figure(num: int, images: list, star: bool = False, citation: str = '') -> str:
+    """ Figure environment """
+    env = 'figure*' if star else 'figure'
+    graphics = '\n'.join(f"\\includegraphics[width=0.45\\textwidth]{{{k}}}" for k in images)
+    return (f"\\begin{{{env}}}\n\\centering\n{graphics}\n"
+            f"\\caption{{Figure {num} showing the \\emph{{{WORDS[num % len(WORDS)]}}} "
+            f"of the sample {citation}.}}\n\\label{{fig:f{num}}}\n\\end{{{env}}}\n")
+
+
+def _bibkeys(n: int) -> list:
+    return [f"author{k:04d}" for k in range(n)]
+
+
+def _bbl(rng: random.Random, keys: list) -> str:
+    """ aa style compiled bibliography """
+    items = [r"\begin{thebibliography}{}"]
+    for key in keys:
+        names = [_name(rng).split() for _ in range(rng.randint(1, 5))]
+        year = rng.randint(1950, 2023)
+        first = names[0][1]
+        etal = ' {et~al.}' if len(names) > 2 else ''
+        authors = ', '.join(f"{{{k[1]}}}, {k[0][0]}." for k in names)
+        items.append(f"\\bibitem[{{{first}}}{etal}({year})]{{{key}}}\n"
+                     f"{authors} {year}, \\apj, {rng.randint(1, 999)}, {rng.randint(1, 999)}")
+    items.append(r"\end{thebibliography}")
+    return '\n'.join(items) + '\n'
+
+
+def _bib(rng: random.Random, keys: list) -> str:
+    """ BibTeX database """
+    entries = []
+    for key in keys:
+        names = ' and '.join('{{{1}}}, {0}'.format(*_name(rng).split())
+                             for _ in range(rng.randint(1, 8)))
+        entries.append(f"@ARTICLE{{{key},\n   author = {{{names}}},\n"
+                       f"    title = \"{{{_sentence(rng).strip()}}}\",\n"
+                       f"  journal = {{\\apj}},\n     year = {rng.randint(1950, 2023)},\n"
+                       f"   volume = {{{rng.randint(1, 999)}}},\n"
+                       f"   adsurl = {{https://ui.adsabs.harvard.edu/abs/{key}}},\n}}\n")
+    return '\n'.join(entries)
+
+
+def _paper(rng: random.Random, nauthors: int = 5, nsections: int = 5,
+           nparagraphs: int = 4, nfigures: int = 3, nrefs: int = 30,
+           bibliography: str = 'bbl', multi_author: bool = False,
+           inputs: int = 0) -> Dict[str, bytes]:
+    """ Generated paper source tree """
+    files = {}
+    refs = _bibkeys(nrefs)
+    labels = [f"fig:f{k}" for k in range(1, nfigures + 1)]
+
+    if multi_author:
+        authors = '\n'.join(f"\\author{{{_name(rng)}}}\\affiliation{{{AFFILIATION}}}"
+                            for _ in range(nauthors))
+    else:
+        authors = ("\\author{" + ' \\and '.join(_name(rng) for _ in range(nauthors)) +
+                   "}\n\\institute{" + AFFILIATION + "}")
+
+    body = []
+    for num in range(1, nsections + 1):
+        section = _section(rng, f"Section {num}", nparagraphs, refs=refs, labels=labels)
+        if inputs:
+            name = f"sections/section{num:02d}"
+            files[name + '.tex'] = section.encode()
+            body.append(f"\\input{{{name}}}\n")
+        else:
+            body.append(section)
+    for num in range(1, nfigures + 1):
+        images = [f"figures/fig{num:02d}_{sub}.png" for sub in range(1, rng.randint(1, 3) + 1)]
+        for image in images:
+            files[image] = _png(rng)
+        body.insert(rng.randrange(len(body) + 1),
+                    _figure(num, images, star=bool(num % 2), citation=_citation(rng, refs)))
+
+    if bibliography == 'bib':
+        files['refs.bib'] = _bib(rng, refs).encode()
+        closing = "\\bibliographystyle{aa}\n\\bibliography{refs}\n"
+    else:
+        files['main.bbl'] = _bbl(rng, refs).encode()
+        closing = ""
+
+    main = (f"\\documentclass{{aa}}\n\\usepackage{{graphicx}}\n"
+            f"\\newcommand{{\\msun}}{{M_\\odot}}\n\\def\\kms{{km\\,s$^{{-1}}$}}\n"
+            f"\\begin{{document}}\n\\title{{A generated study of {rng.choice(WORDS)}s "
+            f"with H{rng.choice(ACCENTS)}lium}}\n{authors}\n"
+            f"\\abstract{{{''.join(_sentence(rng, refs=refs) for _ in range(3))}}}\n"
+            f"\\begin{{abstract}}\n{''.join(_sentence(rng, refs=refs) for _ in range(6))}"
+            f"\\end{{abstract}}\n\\maketitle\n" +
+            ''.join(body) + closing + "\\end{document}\n")
+    files['main.tex'] = main.encode()
+    return files
+
+
+def generate_corpus(seed: int = 20230101) -> Dict[str, Dict[str, bytes]]:
+    """ Generate the benchmark corpus
+
+    :param seed: random seed (fixed to freeze the corpus)
+    :return: mapping of tree names to source trees (file name -> content)
+    """
+    rng = random.Random(seed)
+    return {
+        'small': _paper(rng),
+        'collaboration': _paper(rng, nauthors=1200, multi_author=True, nsections=6),
+        'many_figures': _paper(rng, nfigures=40, nsections=8),
+        'bbl_only': _paper(rng, nrefs=600, bibliography='bbl'),
+        'bib_only': _paper(rng, nrefs=2000, bibliography='bib'),
+        'multi_file': _paper(rng, inputs=True, nsections=15),
+        'long_text': _paper(rng, nsections=40, nparagraphs=25, nrefs=200),
+    }
+
+
+def write_corpus(directory: str, seed: int = 20230101) -> Dict[str, str]:
+    """ Write the corpus to disk
+
+    :param directory: where to write the trees (one folder per tree)
+    :param seed: random seed
+    :return: mapping of tree names to their folder
+    """
+    folders = {}
+    for name, files in generate_corpus(seed).items():
+        folder = os.path.join(directory, name)
+        for fname, data in files.items():
+            where = os.path.join(folder, fname)
+            os.makedirs(os.path.dirname(where), exist_ok=True)
+            with open(where, 'wb') as fout:
+                fout.write(data)
+        folders[name] = folder
+    return folders
@@ -0,0 +1,232 @@
+""" Benchmark the document processing stages over the frozen corpus
+
+Runs fully offline on the synthetic corpus of :mod:`corpus` and reports,
+per source tree and stage, the best wall time over a few repeats, the
+throughput (MB/s of processed source) and the peak traced memory.
+
+Usage::
+
+    python benchmarks/run_benchmarks.py                       # all trees
+    python benchmarks/run_benchmarks.py -k bib_only -r 5      # one tree, 5 repeats
+    python benchmarks/run_benchmarks.py -o results.json       # save the results
+    python benchmarks/run_benchmarks.py --compare results.json  # compare to saved results
+    python benchmarks/run_benchmarks.py --lazy-bib            # only load the cited references
+
+Stages are benchmarked in the order of the daily processing: document
+loading and parsing (`LatexDocument`), markdown generation, bibliography
+parsing (`LatexBib.from_doc`) and citation replacement. The detailed
+timings of the nested stages (cleaning, TexSoup parsing, ...) come from
+:mod:`arxiv_on_deck_2.instrument`. The stages run on in-memory trees so
+that disk access does not blur the comparison.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+from typing import Callable, Dict, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import generate_corpus                                  # noqa: E402
+from arxiv_on_deck_2 import instrument                              # noqa: E402
+from arxiv_on_deck_2.latex import LatexDocument, tex2md             # noqa: E402
+from arxiv_on_deck_2.latex_bib import (LatexBib, get_cited_keys,    # noqa: E402
+                                       replace_citations)
+from arxiv_on_deck_2.source_tree import MemoryTree                  # noqa: E402
+
+
+def _source_size(files: Dict[str, bytes]) -> int:
+    """ bytes of TeX and bibliography sources in a tree """
+    return sum(len(v) for k, v in files.items() if k.endswith(('.tex', '.bbl', '.bib')))
+
+
+def _stages(files: Dict[str, bytes], engine: str = 'texsoup',
+            lazy_bibliography: bool = False) -> Sequence[tuple]:
+    """ Stage functions chained on a tree: (name, func(state) -> None) """
+    def load(state):
+        state['doc'] = LatexDocument(MemoryTree(files), validation=None, engine=engine)
+
+    def markdown(state):
+        state['md'] = state['doc'].generate_markdown_text()
+
+    def abstract(state):
+        state['abstract_md'] = tex2md(state['doc'].abstract)
+
+    def bibliography(state):
+        keys = get_cited_keys(state['md']) if lazy_bibliography else None
+        state['bib'] = LatexBib.from_doc(state['doc'], keys=keys)
+
+    def citations(state):
+        if state['bib'] is not None:
+            replace_citations(state['md'], state['bib'])
+
+    return (('document', load), ('markdown', markdown), ('tex2md', abstract),
+            ('bibliography', bibliography), ('citations', citations))
+
+
+def _run_once(files: Dict[str, bytes], trace_memory: bool = False,
+              engine: str = 'texsoup', lazy_bibliography: bool = False) -> Dict[str, dict]:
+    """ Run all stages once on a tree
+
+    :param files: source tree
+    :param trace_memory: set to record the peak memory of each stage (slower)
+    :param engine: parsing engine of the documents
+    :param lazy_bibliography: set to only load the references cited in the summary
+    :return: {stage: dict(time=seconds, peak=bytes)}
+    """
+    state = {}
+    results = {}
+    for name, func in _stages(files, engine=engine, lazy_bibliography=lazy_bibliography):
+        if trace_memory:
+            tracemalloc.start()
+        tic = time.perf_counter()
+        func(state)
+        duration = time.perf_counter() - tic
+        peak = 0
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[name] = dict(time=duration, peak=peak)
+    return results
+
+
+def benchmark_tree(name: str, files: Dict[str, bytes], repeat: int = 3,
+                   engine: str = 'texsoup', lazy_bibliography: bool = False) -> dict:
+    """ Benchmark the stages on a tree
+
+    Times are the best of `repeat` runs; the peak memory is measured in an
+    additional traced run (tracing slows down the execution).
+
+    :param name: name of the tree
+    :param files: source tree
+    :param repeat: number of timed runs
+    :param engine: parsing engine of the documents
+    :param lazy_bibliography: set to only load the references cited in the summary
+    :return: dict(size, stages={stage: dict(time, peak, throughput)}, substages, counters)
+    """
+    size = _source_size(files)
+    best = {}
+    instrument.reset()
+    instrument.enable()
+    try:
+        with instrument.paper_context(name):
+            for _ in range(repeat):
+                for stage, info in _run_once(files, engine=engine,
+                                             lazy_bibliography=lazy_bibliography).items():
+                    best[stage] = min(best.get(stage, float('inf')), info['time'])
+    finally:
+        instrument.disable()
+    substages = {stage: info['total'] / repeat
+                 for stage, info in instrument.summary().items()}
+    counters = {name: info['count'] / repeat
+                for name, info in instrument.counters().items()}
+    instrument.reset()
+
+    peaks = {stage: info['peak']
+             for stage, info in _run_once(files, trace_memory=True, engine=engine,
+                                          lazy_bibliography=lazy_bibliography).items()}
+    stages = {stage: dict(time=best[stage], peak=peaks[stage],
+                          throughput=size / best[stage] / 1024 ** 2 if best[stage] > 0 else 0.)
+              for stage in best}
+    return dict(size=size, files=len(files), stages=stages, substages=substages,
+                counters=counters)
+
+
+def run(names: Sequence[str] = None, repeat: int = 3, engine: str = 'texsoup',
+        lazy_bibliography: bool = False,
+        report: Callable[[str], None] = print) -> Dict[str, dict]:
+    """ Benchmark the corpus
+
+    :param names: trees to benchmark (default all)
+    :param repeat: number of timed runs per tree
+    :param engine: parsing engine of the documents
+    :param lazy_bibliography: set to only load the references cited in the summary
+    :param report: function called with the result lines
+    :return: {tree: results of :func:`benchmark_tree`}
+    """
+    corpus = generate_corpus()
+    results = {}
+    for name, files in corpus.items():
+        if names and name not in names:
+            continue
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            results[name] = benchmark_tree(name, files, repeat=repeat, engine=engine,
+                                           lazy_bibliography=lazy_bibliography)
+        info = results[name]
+        report(f"{name:s}: {info['files']:,d} files, {info['size'] / 1024:,.0f} kB of sources")
+        for stage, current in info['stages'].items():
+            report(f"    {stage:14s} {current['time']:8.3f} s  {current['throughput']:8.2f} MB/s"
+                   f"  peak {current['peak'] / 1024 ** 2:8.2f} MB")
+        for stage, duration in sorted(info['substages'].items(), key=lambda x: -x[1]):
+            report(f"      - {stage:20s} {duration:8.3f} s")
+        for counter, count in sorted(info['counters'].items()):
+            report(f"      # {counter:20s} {count:8.0f}")
+    return results
+
+
+def compare(results: Dict[str, dict], reference: Dict[str, dict],
+            threshold: float = 1.2, report: Callable[[str], None] = print) -> Sequence[str]:
+    """ Compare results with reference results
+
+    :param results: current results
+    :param reference: reference results (e.g., from a previous run)
+    :param threshold: ratio of times above which a stage is a regression
+    :param report: function called with the result lines
+    :return: list of regressions (tree/stage)
+    """
+    regressions = []
+    for name, info in results.items():
+        if name not in reference:
+            continue
+        for stage, current in info['stages'].items():
+            ref = reference[name]['stages'].get(stage)
+            if not ref or ref['time'] <= 0:
+                continue
+            ratio = current['time'] / ref['time']
+            flag = ''
+            if ratio > threshold:
+                flag = '  <-- regression'
+                regressions.append(f"{name}/{stage}")
+            report(f"{name:s}/{stage:14s} {ref['time']:8.3f} s -> {current['time']:8.3f} s"
+                   f"  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', '--tree', action='append', dest='names',
+                        help='tree of the corpus to run (repeatable, default all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timed runs per tree')
+    parser.add_argument('-e', '--engine', default='texsoup', choices=('texsoup', 'fast'),
+                        help='parsing engine of the documents')
+    parser.add_argument('--lazy-bib', action='store_true',
+                        help='only load the references cited in the summary')
+    parser.add_argument('-o', '--output', help='save the results to a json file')
+    parser.add_argument('--compare', help='json file of reference results')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='time ratio flagged as a regression when comparing')
+    args = parser.parse_args(argv)
+
+    results = run(args.names, repeat=args.repeat, engine=args.engine,
+                  lazy_bibliography=args.lazy_bib)
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as fin:
+            reference = json.load(fin)
+        print("\nComparison with", args.compare)
+        if compare(results, reference, threshold=args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
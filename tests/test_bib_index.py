@@ -0,0 +1,89 @@
+""" The key-offset indexes give the entries of the full parsing of the files """
+
+import pytest
+from arxiv_on_deck_2.bib_index import BibIndex, get_spans, index_bbl, index_bib
+from arxiv_on_deck_2.latex_bib import parse_bbl, parse_bib
+from arxiv_on_deck_2.source_tree import MemoryTree
+
+
+BIB = r"""% comment line
+@string{apj = {The Astrophysical Journal}}
+@comment{not an entry}
+@ARTICLE{a2020,
+   author = {{Doe}, J. and {Roe}, K.},
+    title = "{Emission line @ low (z<0.1) redshift}",
+ abstract = {We study the line @ low (z<0.1) redshift, @article{fake, title={x}}.},
+  journal = apj,
+     year = 2020,
+}
+@preamble{"\newcommand{\noop}[1]{}"}
+@Article(b2021,
+   author = {{Smith}, A.},
+    title = "A title with ) and ( and @misc{other}",
+  journal = apj,
+     year = 2021
+)
+@misc{C2022, author = {{Lee}, B.}, title = {Last {entry}}, year = 2022}
+"""
+
+BBL = r"""\begin{thebibliography}{}
+\bibitem[{Doe} \& {Roe}(2020)]{a2020}
+{Doe}, J., {Roe}, K. 2020, \apj, 1, 2
+\bibitem[{Smith}(2021)]{b2021}
+{Smith}, A. 2021, \apj, 3, 4
+\bibitem[{Lee}(2022)]{C2022}
+{Lee}, B. 2022, \apj, 5, 6
+\end{thebibliography}
+"""
+
+
+def test_index_bib():
+    index = index_bib(BIB)
+    assert list(index['entries']) == ['a2020', 'b2021', 'c2022']
+    assert len(index['strings']) == 1
+    for key, (start, end) in index['entries'].items():
+        text = BIB[start:end]
+        assert text.lower().startswith('@')
+        assert text.endswith(('}', ')'))
+    start, end = index['entries']['a2020']
+    assert 'fake' in BIB[start:end]
+    start, end = index['entries']['b2021']
+    assert BIB[start:end].rstrip().endswith('2021\n)')
+
+
+def test_index_bbl():
+    index = index_bbl(BBL)
+    assert list(index['entries']) == ['a2020', 'b2021', 'c2022']
+    assert index['strings'] == []
+    spans = get_spans(index, ['C2022', 'A2020', 'unknown'])
+    assert [BBL[start:end].split(']')[1][:7] for start, end in spans] == ['{a2020}', '{C2022}']
+
+
+def _entries(bibdata) -> dict:
+    return {key.lower(): (entry.type.lower(), dict(entry.fields),
+                          {role: [str(p) for p in persons] for role, persons in entry.persons.items()})
+            for key, entry in bibdata.entries.items()}
+
+
+@pytest.mark.parametrize('keys', [['a2020'], ['B2021'], ['c2022', 'a2020'], ['unknown']])
+def test_lazy_bib(keys):
+    tree = MemoryTree({'refs.bib': BIB})
+    full = _entries(parse_bib('refs.bib', tree=tree))
+    lazy = _entries(parse_bib('refs.bib', tree=tree, keys=keys, index=BibIndex(None)))
+    assert lazy == {key.lower(): full[key.lower()] for key in keys if key.lower() in full}
+
+
+@pytest.mark.parametrize('keys', [['a2020'], ['B2021'], ['c2022', 'a2020'], ['unknown']])
+def test_lazy_bbl(keys):
+    tree = MemoryTree({'main.bbl': BBL})
+    full = _entries(parse_bbl('main.bbl', tree=tree))
+    lazy = _entries(parse_bbl('main.bbl', tree=tree, keys=keys, index=BibIndex(None)))
+    assert lazy == {key.lower(): full[key.lower()] for key in keys if key.lower() in full}
+
+
+def test_index_persistence(tmp_path):
+    index = BibIndex(str(tmp_path))
+    index.get(BIB, 'bib')
+    other = BibIndex(str(tmp_path))
+    assert other.get(BIB, 'bib') == index_bib(BIB)
+    assert (other.hits, other.misses) == (1, 0)
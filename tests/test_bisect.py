@@ -0,0 +1,51 @@
+""" The recovery parsing drops only the failing lines within a logarithmic number of attempts """
+
+import math
+import warnings
+import pytest
+from arxiv_on_deck_2 import latex
+from arxiv_on_deck_2.latex import get_content_bisect
+
+
+def make_source(nsections: int = 6, nlines: int = 30, broken: tuple = (2, 5)) -> str:
+    text = []
+    for num in range(1, nsections + 1):
+        text.append(f'\\section{{Section {num}}}\n')
+        text.extend(f'Line {k} of section {num} with $x_{k}$ math.\n' for k in range(nlines))
+        if num in broken:
+            text.insert(len(text) - nlines // 2, 'broken \\[ display never closed\n')
+    return ''.join(text)
+
+
+@pytest.fixture
+def attempts(monkeypatch):
+    """ count the parse attempts """
+    calls = []
+    parse = latex.TexSoup
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return parse(*args, **kwargs)
+    monkeypatch.setattr(latex, 'TexSoup', counted)
+    return calls
+
+
+def test_bisect_minimal_spans():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        content, dropped = get_content_bisect(make_source())
+    assert len(dropped) == 2
+    assert all(span['lines'][0] == span['lines'][1] for span in dropped)
+    assert all(span['text'].startswith('broken') for span in dropped)
+    assert 'Line 29 of section 6' in str(content)
+
+
+@pytest.mark.parametrize('broken', [(1,), (2, 5), tuple(range(1, 21))])
+def test_bisect_attempts_bounded(attempts, broken):
+    source = make_source(nsections=20, broken=broken)
+    nlines = source.count('\n')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        get_content_bisect(source, max_attempts=16)
+    # pending halves are parsed once when the budget is exhausted (one per level)
+    assert len(attempts) <= 16 + math.ceil(math.log2(nlines))
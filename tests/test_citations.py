@@ -0,0 +1,123 @@
+""" The single-pass citation replacement gives the markdown of the former
+one-pass-per-command implementation, and keeps the [pre][post] notes """
+
+import warnings
+import pytest
+from arxiv_on_deck_2.latex import LatexDocument
+from arxiv_on_deck_2.latex_bib import CITATION_KINDS, LatexBib, get_cited_keys, replace_citations
+
+
+MAIN = rb"""\documentclass{aa}
+\begin{document}
+\title{A title}
+\author{An Author}
+\abstract{An abstract.}
+\maketitle
+Some text.
+\end{document}
+"""
+
+BBL = rb"""\begin{thebibliography}{}
+\bibitem[{Smith} {et~al.}(2001)]{smith}
+{Smith}, A., {Doe}, B., {Roe}, C. 2001, \apj, 1, 2
+\bibitem[{Doe} \& {Roe}(1999)]{doe}
+{Doe}, B., {Roe}, C. 1999, \apj, 3, 4
+\end{thebibliography}
+"""
+
+SMITH_P = '[Smith, Doe and Roe 2001]()'
+SMITH_T = '[Smith, Doe and Roe (2001)]()'
+DOE_P = '[Doe and Roe 1999]()'
+DOE_T = '[Doe and Roe (1999)]()'
+
+# markdown of the former implementation
+CITATIONS = [
+    (r'\citep{smith}', f' ({SMITH_P}) '),
+    (r'\citet{smith}', SMITH_T),
+    (r'\cite{doe}', DOE_T),
+    (r'\citealt{doe}', f' ({DOE_P}) '),
+    (r'\citep{smith, doe}', f' ({SMITH_P}, {DOE_P}) '),
+    (r'\citet{smith,doe}', f'{SMITH_T}, {DOE_T}'),
+    (r'see \citet{doe} and \citep{smith}.', f'see {DOE_T} and  ({SMITH_P}) .'),
+]
+
+# notes were left untouched by the former implementation
+NOTES = [
+    (r'\citep[see][p. 3]{smith}', f' (see {SMITH_P}, p. 3) '),
+    (r'\citep[p. 3]{smith}', f' ({SMITH_P}, p. 3) '),
+    (r'\citep[e.g.][]{smith, doe}', f' (e.g. {SMITH_P}, {DOE_P}) '),
+    (r'\citet[sec. 2]{doe}', f'{DOE_T}, sec. 2'),
+    (r'\cite[][fig. 1]{doe}', f'{DOE_T}, fig. 1'),
+    (r'\citealt[see][]{doe}', f' (see {DOE_P}) '),
+]
+
+# commands supported by the single pass (and starred forms)
+KINDS = [
+    (r'\citealp{smith, doe}', f' ({SMITH_P}, {DOE_P}) '),
+    (r'\citealp[see][]{doe}', f' (see {DOE_P}) '),
+    (r'\citeauthor{smith}', '[Smith, Doe and Roe]()'),
+    (r'\citeauthor{doe}', '[Doe and Roe]()'),
+    (r'\citeyear{doe}', '[1999]()'),
+    (r'\citeyear[p. 2]{smith}', '[2001](), p. 2'),
+    (r'\citep*{smith}', f' ({SMITH_P}) '),
+    (r'\citet*{doe}', DOE_T),
+    (r'\cite*{doe}', DOE_T),
+    (r'\citealt*{doe}', f' ({DOE_P}) '),
+    (r'\citealp*{smith}', f' ({SMITH_P}) '),
+    (r'\citeauthor*{smith}', '[Smith, Doe and Roe]()'),
+    (r'\citeyear*{smith}', '[2001]()'),
+]
+
+
+@pytest.fixture(scope='module')
+def bibdata():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        doc = LatexDocument({'main.tex': MAIN, 'main.bbl': BBL}, engine='fast')
+        return LatexBib.from_doc(doc)
+
+
+@pytest.mark.parametrize('text, expected', CITATIONS + NOTES + KINDS)
+def test_replace_citations(bibdata, text, expected):
+    assert replace_citations(text, bibdata) == expected
+
+
+def test_citation_kinds_tested():
+    commands = [text[1:].split('{')[0].split('[')[0] for text, _ in KINDS]
+    assert set(CITATION_KINDS) <= {k.rstrip('*') for k in commands if k.endswith('*')}
+    assert set(CITATION_KINDS) - {'cite', 'citet', 'citep', 'citealt'} <= set(commands)
+
+
+def test_cited_keys_are_replaced(bibdata):
+    text = (r'\citep{smith} \nocite{*} \citenum{doe} \citeyear*{doe} '
+            r'\citet [see]{smith} \citeauthor{unknown}')
+    assert get_cited_keys(text) == ['smith', 'doe', 'unknown']
+    replaced = replace_citations(text, bibdata)
+    assert r'\nocite{*}' in replaced and r'\citenum{doe}' in replaced
+    assert r'\citet [see]{smith}' in replaced
+
+
+def test_replace_citations_kind(bibdata):
+    text = r'\citep{smith} \citet{doe}'
+    assert replace_citations(text, bibdata, kind='citet') == r'\citep{smith} ' + DOE_T
+    assert replace_citations(text, bibdata, kind='citep') == f' ({SMITH_P})  ' + r'\citet{doe}'
+
+
+def test_replace_citations_unknown_key(bibdata):
+    assert replace_citations(r'\citep{unknown}', bibdata) == ' (unknown) '
+    with pytest.raises(KeyError):
+        replace_citations(r'\citep{unknown}', bibdata, raise_exceptions=True)
+
+
+def test_citation_cache_lru(bibdata):
+    bib = LatexBib(bibdata.bibdata, cache_size=2)
+    bib.get_citation_md('smith', kind='citet')
+    bib.get_citation_md('doe', kind='citet')
+    bib.get_citation_md('smith', kind='citet')
+    bib.get_citation_md('doe', kind='citep')
+    # the recently used citation is kept, the least recently used one is evicted
+    assert bib.get_citation_md('smith', kind='citet') == SMITH_T
+    assert (bib.hits, bib.misses) == (2, 3)
+    bib.get_citation_md('doe', kind='citet')
+    assert (bib.hits, bib.misses) == (2, 4)
+    assert bib.cache_info()['size'] == 2
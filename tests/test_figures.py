@@ -0,0 +1,54 @@
+""" The figures are converted at the resolution that fits the target box """
+
+import io
+import pytest
+from PIL import Image
+from arxiv_on_deck_2 import latex
+from arxiv_on_deck_2.latex import FIGURE_BOX, fit_dpi, get_pdf_page_sizes
+from arxiv_on_deck_2.source_tree import MemoryTree
+
+
+# page tree with inherited boxes and rotation, and a box in an unrelated object
+PDF = b"""%PDF-1.4
+1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj
+2 0 obj << /Type /Pages /Kids [3 0 R 4 0 R 5 0 R] /Count 3
+           /MediaBox [0 0 612 792] /Rotate 90 >> endobj
+3 0 obj << /Type /Page /Parent 2 0 R >> endobj
+4 0 obj << /Type /Page /Parent 2 0 R /Rotate 0 /CropBox [10 10 310 210] >> endobj
+5 0 obj << /Type /Page /Parent 2 0 R /MediaBox [0 0 100 50] /Rotate 270 >> endobj
+6 0 obj << /Type /XObject /Subtype /Form /MediaBox [0 0 5000 5000] >> endobj
+trailer << /Root 1 0 R >>
+%%EOF
+"""
+
+
+def test_fit_dpi():
+    assert fit_dpi((612, 792), FIGURE_BOX) == int(72 * 800 / 792)
+    assert fit_dpi((72, 72), FIGURE_BOX, max_dpi=300) == 300
+
+
+def test_pdf_page_sizes():
+    assert sorted(get_pdf_page_sizes(PDF)) == sorted([(792., 612.), (300., 200.), (50., 100.)])
+
+
+def test_pdf_page_sizes_pillow():
+    buffer = io.BytesIO()
+    Image.new('RGB', (144, 72)).save(buffer, 'PDF', resolution=72)
+    assert get_pdf_page_sizes(buffer.getvalue()) == [(144., 72.)]
+
+
+def test_fallback_size_fits_box(monkeypatch):
+    """ pages of unknown sizes are rendered at the box width and shrunk into the box """
+    import pdf2image
+    options = {}
+
+    def convert(data, **kwargs):
+        options.update(kwargs)
+        return [Image.new('RGB', (1200, 1800)), Image.new('RGB', (1200, 300))]
+    monkeypatch.setattr(pdf2image, 'convert_from_bytes', convert)
+    monkeypatch.setattr(latex, 'get_pdf_page_sizes', lambda data: [])
+    tree = MemoryTree({'f.pdf': b'%PDF-1.5'})
+    assert latex.convert_pdf_to_image('f.pdf', tree) == 'f.*.png'
+    assert options['size'] == (FIGURE_BOX[0], None)
+    sizes = [Image.open(io.BytesIO(tree.read_bytes(f'f.{k}.png'))).size for k in (1, 2)]
+    assert sizes == [(533, 800), (1200, 300)]
@@ -0,0 +1,52 @@
+""" The fast engine extracts the same macros as the full TexSoup parsing """
+
+import warnings
+import pytest
+from arxiv_on_deck_2.latex import LatexDocument, extract_fragments
+
+
+DOCUMENT = r"""\documentclass{article}
+{definitions}
+\begin{document}
+\title{A title}
+\author{An Author}
+\begin{abstract}
+An abstract.
+\end{abstract}
+{\bf bold text} after the definitions.
+\end{document}
+"""
+
+DEFINITIONS = [
+    r'\newcommand{\msun}{M_\odot}',
+    r'\newcommand\msun{M_\odot}',
+    r'\renewcommand\msun{M_\odot}',
+    r'\providecommand\msun{M_\odot}',
+    r'\newcommand{\vect}[1]{\mathbf{#1}}',
+    r'\newcommand{\msun}' + '\n' + r'{M_\odot}',
+    r'\newcommand{\msun}{M_\odot}' + '\n' + r'{\it unrelated}',
+    r'\def\msun{M_\odot}',
+    r'\def\vect#1{\mathbf{#1}}',
+]
+
+
+def get_macros(definitions: str, engine: str):
+    files = {'main.tex': DOCUMENT.replace('{definitions}', definitions)}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return LatexDocument(files, engine=engine).macros
+
+
+@pytest.mark.parametrize('definitions', DEFINITIONS)
+def test_fast_engine_macros(definitions):
+    assert get_macros(definitions, 'fast') == get_macros(definitions, 'texsoup')
+
+
+@pytest.mark.parametrize('source, fragment', [
+    (r'\newcommand\msun{M_\odot} text', r'\newcommand\msun{M_\odot}'),
+    (r'\def\foo#1{a#1} text', r'\def\foo#1{a#1}'),
+    (r'\newcommand{\a}{x}' + '\n' + r'{\bf y}', r'\newcommand{\a}{x}'),
+    (r'\title' + '\n' + r'{T}' + '\n\n' + r'{U}', r'\title' + '\n' + r'{T}'),
+])
+def test_extract_fragments(source, fragment):
+    assert extract_fragments(source) == [fragment]
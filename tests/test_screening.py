@@ -0,0 +1,39 @@
+""" The screening of a listing returns annotated candidates without changing the listing """
+
+import copy
+from arxiv_on_deck_2.arxiv2 import ArxivPaper, screen_listing
+
+
+def make_listing():
+    return [ArxivPaper(identifier=f'arXiv:2301.0000{k}', title=f'Paper {k}', authors=authors,
+                       comments='', abstract='')
+            for k, authors in enumerate([['Jane Doe', 'Paul Roe'], ['Ann Smith'],
+                                         ['P. Roe', 'Bob Lee', 'Jane Doe']])]
+
+
+def test_screen_listing_copies():
+    papers = make_listing()
+    original = copy.deepcopy(papers)
+    result = screen_listing(papers, ['Jane Doe'])
+    assert papers == original
+    assert [paper['identifier'] for paper in result['candidates']] == ['arXiv:2301.00000',
+                                                                        'arXiv:2301.00002']
+    assert result['candidates'][0]['authors'] == ['<mark>Jane Doe</mark>', 'Paul Roe']
+    assert all(isinstance(paper, ArxivPaper) for paper in result['candidates'])
+    assert result['statistics']['candidates'] == 2
+
+
+def test_screen_listing_inplace():
+    papers = make_listing()
+    result = screen_listing(papers, ['Jane Doe'], inplace=True)
+    assert result['candidates'][0] is papers[0]
+    assert papers[2]['authors'][-1] == '<mark>Jane Doe</mark>'
+    assert papers[1]['authors'] == ['Ann Smith']
+
+
+def test_screen_listing_no_highlight():
+    papers = make_listing()
+    result = screen_listing(papers, ['Jane Doe'], highlight=False)
+    assert result['candidates'][0] is papers[0]
+    assert papers[0]['authors'] == ['Jane Doe', 'Paul Roe']
+    assert result['authors'][0] == ['<mark>Jane Doe</mark>', 'Paul Roe']
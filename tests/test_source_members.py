@@ -0,0 +1,88 @@
+""" The selective reading of e-prints keeps the TeX files and the referenced files """
+
+import gzip
+import io
+import tarfile
+import warnings
+import pytest
+from arxiv_on_deck_2.arxiv2 import read_source_members, referenced_files
+
+
+MAIN = rb"""\documentclass{aa}
+\begin{document}
+\input{sections/intro}
+\input{tables/table1.txt}
+\input fig.pgf
+\include{appendix.pdf_tex}
+% \includegraphics{commented.png}
+\includegraphics[width=3cm]{figures/anim.gif}
+\includegraphics{figures/big}
+\end{document}
+"""
+
+FILES = {
+    'main.tex': MAIN,
+    'sections/intro.tex': rb'\includegraphics{plot.svg}',
+    'tables/table1.txt': b'1 & 2 \\\\',
+    'fig.pgf': b'%% pgf',
+    'appendix.pdf_tex': b'%% pdf_tex',
+    'figures/anim.gif': b'GIF89a' + b'0' * 100,
+    'figures/plot.svg': b'<svg/>',
+    'figures/big.png': b'0' * 5000,
+    'figures/unused.png': b'0' * 100,
+    'commented.png': b'0' * 100,
+    'README.txt': b'notes',
+}
+
+KEPT = {'main.tex', 'sections/intro.tex', 'tables/table1.txt', 'fig.pgf', 'appendix.pdf_tex',
+        'figures/anim.gif', 'figures/plot.svg'}
+
+
+class Stream(io.RawIOBase):
+    """ non-seekable stream """
+    def __init__(self, data: bytes):
+        self.buffer = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.buffer.readinto(buffer)
+
+
+def make_eprint(files: dict) -> bytes:
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode='w') as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return gzip.compress(raw.getvalue())
+
+
+def test_referenced_files():
+    references = referenced_files([MAIN.decode()])
+    assert {'intro', 'table1.txt', 'fig.pgf', 'appendix.pdf_tex', 'anim.gif', 'big'} <= references
+    assert 'commented.png' not in references
+
+
+@pytest.mark.parametrize('seekable', [True, False])
+def test_read_source_members(seekable):
+    data = make_eprint(FILES)
+    fileobj = io.BytesIO(data) if seekable else Stream(data)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        members = read_source_members(fileobj, max_member_size=1000)
+    assert set(members) == KEPT
+    assert all(members[name] == FILES[name] for name in members)
+    assert any('figures/big.png' in str(w.message) for w in caught)
+
+
+def test_spool_total_size():
+    """ the files spilled from non-seekable streams count against the total size """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        members = read_source_members(Stream(make_eprint(FILES)), max_total_size=1000)
+    assert 'figures/big.png' not in members
+    assert any('figures/big.png' in str(w.message) and 'total size' in str(w.message)
+               for w in caught)